@@ -1,12 +1,23 @@
 """
 A DRY argparse helper for common arguments
 """
+from contextlib import nullcontext
 from glob import glob
+from multiprocessing import Pool
+from valtiopy import instrument
 from valtiopy.config import (
     create_new_config,
     load_config,
 )
 import argparse
+import atexit
+import cProfile
+import functools
+import hashlib
+import json
+import os
+import sys
+import time
 import warnings
 
 
@@ -36,6 +47,23 @@ def custom_serializer(obj):
         return f"Non-serializable: {type(obj).__name__}"
 
 
+def shard_spec(s):
+    """
+    argparse type for --shard, parses "i/N" to a tuple (i, N) with 0 <= i < N
+    """
+    try:
+        i, n = [int(_) for _ in s.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected a shard as i/N, got {s}")
+    if n < 1 or not 0 <= i < n:
+        raise argparse.ArgumentTypeError(f"Expected 0 <= i < N in shard i/N, got {s}")
+    return i, n
+
+
+LANGUAGE_CACHE = ".valtiopy-languages.json"
+RESUME_JOURNAL = ".valtiopy-resume"
+
+
 def populate_common_args(parser):
     """
     Add common arguments to a parser that will be used in most of the scripts.
@@ -69,8 +97,11 @@ def populate_common_args(parser):
     parser.add_argument("-l", "--languages",
                         choices = ["f", "s", "fs"],
                         nargs= "+",
-                        default = ['s'],
-                        help = "Parse documents with the selected primary languages")
+                        default = None,
+                        help = "Parse documents with the selected primary languages (default: all documents)")
+    parser.add_argument("--language-cache",
+                        default = LANGUAGE_CACHE,
+                        help = f"Document languages written by valtiopy.language, used by --languages (default: {LANGUAGE_CACHE})")
     parser.add_argument("-k", "--chambers",
                         choices = ["adeln", "borgare", "praster", "talonpajat", "papisto", "porvaristo"],
                         nargs = "+",
@@ -87,9 +118,46 @@ def populate_common_args(parser):
     parser.add_argument("-v", "--verbose",
                         action = 'store_true',
                         help = "Print extra information about what's going on")
+    parser.add_argument("--profile",
+                        nargs = "?",
+                        const = "valtiopy.prof",
+                        default = None,
+                        help = "Dump cProfile output of the run to this file (default: valtiopy.prof) and per-stage timings to <file>.json and <file>.csv")
+    parser.add_argument("-j", "--jobs",
+                        type = int,
+                        default = None,
+                        help = "Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--chunksize",
+                        type = int,
+                        default = None,
+                        help = "Items sent to a worker process at a time (default: depends on the script)")
+    parser.add_argument("--shard",
+                        type = shard_spec,
+                        default = None,
+                        help = "Only process shard i of N (i/N, 0-indexed). Files are assigned to shards by a hash of their document id, so N machines can split the corpus.")
+    parser.add_argument("--resume",
+                        nargs = "?",
+                        const = True,
+                        default = None,
+                        help = f"Record finished files in this journal (default: {RESUME_JOURNAL}-<script>) and skip the ones already in it. The journal is removed when a run finishes.")
     return parser
 
 
+def reject_unsupported(parser, args, *options):
+    """
+    Exit with an error if common options that a script doesn't support were set
+
+    Args
+
+        parser: argparse parser instance
+        args: parsed args
+        options (str): option names, e.g. "resume"
+    """
+    for option in options:
+        if getattr(args, option) != parser.get_default(option):
+            parser.error(f"--{option} is not supported by this script")
+
+
 def fetch_parser(description=None):
     """
     Create a parser instance and populate it with common arguments.
@@ -119,6 +187,26 @@ def impute_arg_values(args):
 
         args
     """
+    def _handle_profile(args):
+        """
+        start cProfile and the stage instrumentation, dump both at exit
+        """
+        if getattr(args, "profile", None) is None:
+            return args
+        if args.verbose: print(f"INFO: Profiling to {args.profile}")
+        instrument.enable()
+        profiler = cProfile.Profile()
+
+        def _dump():
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            instrument.to_json(f"{args.profile}.json")
+            instrument.to_csv(f"{args.profile}.csv")
+
+        atexit.register(_dump)
+        profiler.enable()
+        return args
+
     def _handle_config(args):
         """
         fetch or create configif args.verbose: print(f"INFO:
@@ -221,7 +309,25 @@ def impute_arg_values(args):
 
             args
         """
-        warnings.warn(_filter_language.__name__, NotImplemented)
+        if args.languages is None:
+            return args
+        cache_path = getattr(args, "language_cache", LANGUAGE_CACHE)
+        if not os.path.exists(cache_path):
+            warnings.warn(f"No language cache at {cache_path}, not filtering for languages {args.languages}. Tag the corpus with `python -m valtiopy.language` first.")
+            return args
+        with open(cache_path, 'r') as inf:
+            languages = {k: v["language"] for k, v in json.load(inf)["documents"].items() if v["language"] is not None}
+        if args.verbose: print(f"INFO: filtering docs for language {args.languages}")
+        for format in args.docformats:
+            if hasattr(args, f"{format}_files"):
+                files = getattr(args, f"{format}_files")
+                if args.verbose: print(f"INFO:     starting with {len(files)} {format} files")
+                untagged = {f for f in files if document_id(f) not in languages}
+                if len(untagged) > 0:
+                    warnings.warn(f"{len(untagged)} {format} files have no language in {cache_path}, keeping them")
+                files = [f for f in files if languages.get(document_id(f)) in args.languages or f in untagged]
+                if args.verbose: print(f"INFO:    --->  {len(files)} leftover")
+                setattr(args, f"{format}_files", files)
         return args
 
     def _filter_chamber(args):
@@ -248,10 +354,197 @@ def impute_arg_values(args):
                 setattr(args, f"{format}_files", files)
         return args
 
+    def _filter_shard(args):
+        """
+        select the documents of this machine's shard
+
+        Args
+
+            args: Argparse argument class instances
+
+        Returns
+
+            args
+        """
+        if getattr(args, "shard", None) is None:
+            return args
+        i, n = args.shard
+        if args.verbose: print(f"INFO: selecting shard {i}/{n}")
+        for format in args.docformats:
+            if hasattr(args, f"{format}_files"):
+                files = getattr(args, f"{format}_files")
+                if args.verbose: print(f"INFO:     starting with {len(files)} {format} files")
+                files = shard_files(files, i, n)
+                if args.verbose: print(f"INFO:    --->  {len(files)} leftover")
+                setattr(args, f"{format}_files", files)
+        return args
+
+    args = _handle_profile(args)
     args = _handle_config(args)
     args = _fetch_documents(args)
     args = _filter_doctype(args)
     args = _filter_language(args)
     args = _filter_chamber(args)
+    args = _filter_shard(args)
 
     return args
+
+
+
+def document_id(path):
+    """
+    Return the id of the document a file belongs to, i.e. the filename without extension
+    and without the page number of ALTO and PDF page files.
+
+    Args
+
+        path (str): file path
+
+    Returns
+
+        str
+    """
+    stem = os.path.basename(path).split(".")[0]
+    head, sep, last = stem.rpartition("_")
+    return f"{head}{sep}{last.split('-')[0]}"
+
+
+def shard_files(files, i, n):
+    """
+    Deterministically select the files of shard i of n. All files of a document end up in the same shard.
+
+    Args
+
+        files (list): file paths
+        i (int): shard index, 0 <= i < n
+        n (int): number of shards
+
+    Returns
+
+        list
+    """
+    def _shard(f):
+        return int(hashlib.md5(document_id(f).encode("utf-8")).hexdigest(), 16) % n
+    return [f for f in files if _shard(f) == i]
+
+
+def _apply(func, file_):
+    with instrument.document(document_id(file_)):
+        return file_, func(file_), None
+
+
+def _apply_instrumented(func, file_):
+    # in a worker: collect the stats of this file and send them back to the parent
+    (file_, result, _), stats = instrument.collect(_apply, func, file_)
+    return file_, result, stats
+
+
+def _producer(func):
+    # the module and name of the function, also when the module is run as a script
+    while isinstance(func, functools.partial):
+        func = func.func
+    spec = getattr(sys.modules.get(func.__module__), "__spec__", None)
+    module = spec.name if spec is not None else func.__module__
+    return f"{module}.{func.__qualname__}"
+
+
+def _journal_header(func, args):
+    selection = hashlib.sha256()
+    for format in ["tei", "alto", "pdf"]:
+        for f in getattr(args, f"{format}_files", []):
+            selection.update(f.encode("utf-8") + b"\n")
+    return "# " + json.dumps({"producer": _producer(func), "selection": selection.hexdigest()}, sort_keys=True)
+
+
+def run_over_files(func, args, files=None, ordered=True, on_result=None):
+    """
+    Apply a function to each selected file, in a process pool of `--jobs` workers.
+
+    With `--resume`, a file is done once its result is saved by `on_result`: it is then appended to a
+    journal, and files already in the journal are skipped. The journal is removed when all files are done.
+    Each function has its own journal by default, and a journal written by another function or for another
+    file selection is refused. `on_result` may save results in batches and return the files it has saved,
+    otherwise the file is taken as saved when `on_result` returns.
+    Without `on_result` results are only saved by the caller at the end, so `--resume` is ignored with a warning.
+    Sharding (`--shard`) is already applied to the file lists by `impute_arg_values`.
+    With `--profile`, the stage stats collected in the workers are added to the parent's.
+
+    Args
+
+        func (callable): file path -> result. Must be picklable (module level) when --jobs > 1
+        args: Argparse args processed by `impute_arg_values`
+        files (list): files to process (default: the tei, alto or pdf files of args, in that order)
+        ordered (bool): return results in the order of the files, otherwise in the order they finish
+        on_result (callable): (file, result) -> None or list of saved files, called in the parent process as each file is done, e.g. to save its result
+
+    Returns
+
+        list of (file, result) tuples
+    """
+    if files is None:
+        for format in ["tei", "alto", "pdf"]:
+            if hasattr(args, f"{format}_files"):
+                files = getattr(args, f"{format}_files")
+                break
+        else:
+            raise ValueError("No files selected")
+
+    journal = None
+    if getattr(args, "resume", None) is not None and on_result is None:
+        warnings.warn("--resume is ignored, results are saved at the end of the run")
+    elif getattr(args, "resume", None) is not None:
+        journal_path = args.resume if isinstance(args.resume, str) else f"{RESUME_JOURNAL}-{_producer(func)}"
+        header = _journal_header(func, args)
+        lines = []
+        if os.path.exists(journal_path):
+            with open(journal_path, 'r') as inf:
+                lines = [line.rstrip("\n") for line in inf]
+            if len(lines) > 0 and lines[0] != header:
+                raise ValueError(f"The journal {journal_path} was written by another script or for other files ({lines[0]}). Remove it to start over.")
+        done = set(lines[1:])
+        if args.verbose: print(f"INFO: resuming from {journal_path}, {len(done)} files done already")
+        files = [f for f in files if f not in done]
+        journal = open(journal_path, 'a')
+        if len(lines) == 0:
+            journal.write(header + "\n")
+            journal.flush()
+
+    jobs = getattr(args, "jobs", None) or os.cpu_count()
+    chunksize = getattr(args, "chunksize", None) or 1
+    if jobs > 1 and instrument.is_enabled():
+        call = functools.partial(_apply_instrumented, func)
+    else:
+        call = functools.partial(_apply, func)
+    results = []
+    t0 = last = time.perf_counter()
+    try:
+        with (Pool(processes=jobs) if jobs > 1 else nullcontext()) as pool:
+            if pool is None:
+                it = map(call, files)
+            elif ordered:
+                it = pool.imap(call, files, chunksize=chunksize)
+            else:
+                it = pool.imap_unordered(call, files, chunksize=chunksize)
+            for file_, result, stats in it:
+                if stats is not None:
+                    instrument.merge(stats)
+                results.append((file_, result))
+                saved = [file_]
+                if on_result is not None:
+                    saved = on_result(file_, result)
+                    if saved is None:
+                        saved = [file_]
+                if journal is not None and len(saved) > 0:
+                    journal.write("".join(f + "\n" for f in saved))
+                    journal.flush()
+                now = time.perf_counter()
+                if args.verbose and (now - last > 10 or len(results) == len(files)):
+                    last = now
+                    print(f"INFO: {len(results)}/{len(files)} files done ({len(results) / (now - t0):.2f} files/s)")
+    finally:
+        if journal is not None:
+            journal.close()
+    if journal is not None:
+        # all done, a later run starts over
+        os.remove(journal_path)
+    return results
@@ -0,0 +1,286 @@
+"""
+Benchmark the public conversion, metadata and sampling functions on synthetic data.
+
+Each benchmark is run at several scales, each in a fresh process, and records the best and median wall
+time and the peak memory: the growth of the process's peak RSS over the benchmark's setup, which includes
+libxml2's allocations. Results can be saved as a baseline and later runs compared against it:
+
+    python -m valtiopy.bench --scales small medium --save-baseline bench-baseline.json
+    python -m valtiopy.bench --scales small medium --baseline bench-baseline.json
+"""
+from glob import glob
+from lxml import etree
+from multiprocessing import get_context
+from valtiopy.curate import (
+    convert_alto,
+    dict_to_tei,
+)
+from valtiopy.metadata import join_metadata_tables
+from valtiopy.sample import (
+    goldstandard,
+    goldstandard_stream,
+)
+from valtiopy.synthetic import (
+    generate_corpus,
+    persons_tables,
+    synthetic_pages,
+)
+from valtiopy.utils import (
+    infer_metadata,
+    tei_to_bytes,
+    write_tei,
+)
+import argparse
+import copy
+import json
+import pandas as pd
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+
+
+SCALES = {
+    "small": {"documents": 2, "pages": 5, "paragraphs": 8, "persons": 1000, "rows": 1000},
+    "medium": {"documents": 5, "pages": 20, "paragraphs": 10, "persons": 10000, "rows": 20000},
+    "large": {"documents": 10, "pages": 50, "paragraphs": 12, "persons": 100000, "rows": 200000},
+}
+
+
+def _setup_convert_alto(scale, workdir):
+    generate_corpus(workdir, n_documents=1, n_pages=scale["pages"] * scale["documents"],
+                    paragraphs_per_page=scale["paragraphs"], formats=("alto",))
+    files = sorted(glob(f"{workdir}/valtiopaivat-records-alto/data/**/*.xml", recursive=True))
+    return lambda: convert_alto(files)
+
+
+def _setup_write_tei(scale, workdir):
+    data = infer_metadata("prot_1877_adeln_II")
+    data["paragraphs"] = synthetic_pages(random.Random(0), scale["pages"] * scale["documents"], scale["paragraphs"])
+    dest = f"{workdir}/prot_1877_adeln_II.xml"
+    # a reparsed tree, as written by dict_to_parlaclarin, has the TEI namespace the formatter looks for
+    parser = etree.XMLParser(remove_blank_text=True)
+    tree = etree.fromstring(tei_to_bytes(dict_to_tei(data)), parser)
+    # write_tei formats the tree in place, so write a fresh copy in each run
+    return lambda: write_tei(copy.deepcopy(tree), dest)
+
+
+def _setup_join_metadata_tables(scale, workdir):
+    tables = persons_tables(n_persons=scale["persons"], n_tables=3)
+    return lambda: join_metadata_tables(tables)
+
+
+def _setup_goldstandard(scale, workdir):
+    rng = random.Random(0)
+    df = pd.DataFrame({
+        "path": [f"file_{_}.xml" for _ in range(scale["rows"])],
+        "year": [str(rng.choice(range(1863, 1907, 4))) for _ in range(scale["rows"])],
+        "estate": [rng.choice(["adeln", "borgare", "praster", "talonpojat"]) for _ in range(scale["rows"])],
+    })
+    return lambda: goldstandard(df, n=3, seed="bench", scope="file", sampled_format="alto")
+
+
+def _setup_goldstandard_stream(scale, workdir):
+    rng = random.Random(0)
+    df = pd.DataFrame({
+        "path": [f"file_{_}.xml" for _ in range(scale["rows"])],
+        "year": [str(rng.choice(range(1863, 1907, 4))) for _ in range(scale["rows"])],
+        "estate": [rng.choice(["adeln", "borgare", "praster", "talonpojat"]) for _ in range(scale["rows"])],
+    })
+    return lambda: goldstandard_stream(df, n=3, seed="bench", sampled_format="alto", chunksize=max(1, scale["rows"] // 10))
+
+
+BENCHMARKS = {
+    "convert_alto": _setup_convert_alto,
+    "write_tei": _setup_write_tei,
+    "join_metadata_tables": _setup_join_metadata_tables,
+    "goldstandard": _setup_goldstandard,
+    "goldstandard_stream": _setup_goldstandard_stream,
+}
+
+
+def _max_rss():
+    # kilobytes on linux, bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def measure(func, repeat=5):
+    """
+    Time a function and measure its peak memory.
+
+    The memory is the growth of the process's peak RSS during a first, untimed run, so it is only
+    meaningful in a fresh process (see `run_suite`). Without the `resource` module (Windows) the
+    peak Python heap is measured with tracemalloc instead, which misses libxml2's allocations.
+
+    Args
+
+        func (callable): function without arguments
+        repeat (int): number of timed runs
+
+    Returns
+
+        dict with the keys "best", "median" (seconds) and "peak_memory" (bytes)
+    """
+    # the memory run comes first, before the timed runs raise the peak RSS
+    if resource is not None:
+        rss = _max_rss()
+        func()
+        peak = _max_rss() - rss
+    else:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    return {"best": min(times), "median": statistics.median(times), "peak_memory": peak}
+
+
+def _run_benchmark(name, scale, repeat):
+    with tempfile.TemporaryDirectory() as workdir:
+        func = BENCHMARKS[name](SCALES[scale], workdir)
+        return measure(func, repeat=repeat)
+
+
+def run_suite(scales=("small",), benchmarks=None, repeat=5, verbose=False):
+    """
+    Run benchmarks at the given scales, each in a fresh process so that their peak memory can be measured.
+
+    Args
+
+        scales (list): keys of `SCALES`
+        benchmarks (list): keys of `BENCHMARKS` (default: all)
+        repeat (int): timed runs per benchmark
+        verbose (bool): print results as they come
+
+    Returns
+
+        dict {"meta": {...}, "results": {benchmark: {scale: measurement}}}
+    """
+    if benchmarks is None:
+        benchmarks = list(BENCHMARKS)
+    results = {}
+    ctx = get_context("spawn")
+    for name in benchmarks:
+        results[name] = {}
+        for scale in scales:
+            with ctx.Pool(1) as pool:
+                results[name][scale] = pool.apply(_run_benchmark, (name, scale, repeat))
+            if verbose:
+                r = results[name][scale]
+                print(f"INFO: {name:<24} {scale:<8} best {r['best']:.4f}s  median {r['median']:.4f}s  peak {r['peak_memory'] / 2**20:.1f}MB")
+    meta = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": repeat,
+        "memory": "rss" if resource is not None else "tracemalloc",
+    }
+    return {"meta": meta, "results": results}
+
+
+def compare(results, baseline, tolerance=0.2, min_seconds=0.001, min_bytes=2**20):
+    """
+    Compare results against a baseline.
+    A change is a regression when it is above both the relative tolerance and the absolute minimum,
+    so that noise in very short runs and small allocations isn't reported.
+    Memory isn't compared against baselines measured another way (see "memory" in the meta of `run_suite`).
+
+    Args
+
+        results (dict): output of `run_suite`
+        baseline (dict): earlier output of `run_suite`
+        tolerance (float): allowed relative slowdown / memory increase
+        min_seconds (float): slowdowns of less than this are ignored
+        min_bytes (int): memory increases of less than this are ignored
+
+    Returns
+
+        list of regressions (dicts with the keys "benchmark", "scale", "metric", "baseline", "current" and "ratio")
+    """
+    minimum = {"best": min_seconds, "peak_memory": min_bytes}
+    metrics = ["best"]
+    if baseline["meta"].get("memory") == results["meta"].get("memory"):
+        metrics.append("peak_memory")
+    regressions = []
+    for name, scales in results["results"].items():
+        for scale, r in scales.items():
+            b = baseline["results"].get(name, {}).get(scale)
+            if b is None:
+                continue
+            for metric in metrics:
+                if r[metric] - b[metric] < minimum[metric]:
+                    continue
+                if b[metric] <= 0 or r[metric] / b[metric] > 1 + tolerance:
+                    regressions.append({
+                        "benchmark": name,
+                        "scale": scale,
+                        "metric": metric,
+                        "baseline": b[metric],
+                        "current": r[metric],
+                        "ratio": r[metric] / b[metric] if b[metric] > 0 else float("inf"),
+                    })
+    return regressions
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales",
+                        choices = list(SCALES),
+                        nargs = "+",
+                        default = ["small"],
+                        help = "Scales to run")
+    parser.add_argument("--benchmarks",
+                        choices = list(BENCHMARKS),
+                        nargs = "+",
+                        default = None,
+                        help = "Benchmarks to run (default: all)")
+    parser.add_argument("--repeat",
+                        type = int,
+                        default = 5,
+                        help = "Timed runs per benchmark")
+    parser.add_argument("--baseline",
+                        default = None,
+                        help = "Compare against this baseline file")
+    parser.add_argument("--tolerance",
+                        type = float,
+                        default = 0.2,
+                        help = "Allowed relative regression")
+    parser.add_argument("--min-seconds",
+                        type = float,
+                        default = 0.001,
+                        help = "Ignore slowdowns smaller than this")
+    parser.add_argument("--min-bytes",
+                        type = int,
+                        default = 2**20,
+                        help = "Ignore memory increases smaller than this")
+    parser.add_argument("--save-baseline",
+                        default = None,
+                        help = "Save the results as a baseline to this file")
+    args = parser.parse_args()
+    results = run_suite(scales=args.scales, benchmarks=args.benchmarks, repeat=args.repeat, verbose=True)
+    if args.save_baseline is not None:
+        with open(args.save_baseline, 'w+') as outf:
+            json.dump(results, outf, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as inf:
+            baseline = json.load(inf)
+        regressions = compare(results, baseline, tolerance=args.tolerance, min_seconds=args.min_seconds, min_bytes=args.min_bytes)
+        for r in regressions:
+            print(f"REGRESSION: {r['benchmark']} ({r['scale']}) {r['metric']}: {r['baseline']:.4g} -> {r['current']:.4g} (x{r['ratio']:.2f})")
+        if len(regressions) > 0:
+            sys.exit(1)
@@ -0,0 +1,319 @@
+"""
+Plan incremental rebuilds of the Valtiopaivat Corpus TEI files from their ALTO sources.
+
+A small manifest is kept in each TEI location recording, per document, the fingerprints of the
+ALTO inputs, the valtiopy version and a hash of the conversion settings used for the last build.
+Only documents where one of these has changed (or where the TEI file is missing) are planned for rebuilding.
+"""
+from valtiopy.pipeline import convert_documents
+from valtiopy.utils import (
+    atomic_write,
+    FORMATTER_VERSION,
+)
+import hashlib
+import json
+import os
+
+
+
+
+BUILD_MANIFEST = ".valtiopy-build.json"
+DEFAULT_SETTINGS = {"padding": 8}
+SAVE_EVERY = 100
+
+
+def valtiopy_version():
+    """
+    Return the installed valtiopy version, or "unknown" if it isn't installed as a package.
+    """
+    try:
+        from importlib.metadata import version
+        return version("valtiopy")
+    except Exception:
+        return "unknown"
+
+
+def conversion_settings(settings=None):
+    """
+    Return the settings used for conversion: `DEFAULT_SETTINGS` updated with `settings`.
+
+    Args
+
+        settings (dict): conversion settings, keyword arguments of `valtiopy.pipeline.convert_documents`
+    """
+    return {**DEFAULT_SETTINGS, **(settings or {})}
+
+
+def settings_hash(settings=None):
+    """
+    Hash the conversion settings together with the TEI formatter version.
+
+    Args
+
+        settings (dict): json serializable conversion settings (see `conversion_settings`)
+
+    Returns
+
+        sha256 hexdigest (str)
+    """
+    settings = conversion_settings(settings)
+    s = json.dumps({"settings": settings, "formatter": FORMATTER_VERSION}, sort_keys=True)
+    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+
+
+def fingerprint_file(path, method="stat"):
+    """
+    Fingerprint a file, either by its mtime and size or by a hash of its content.
+
+    Args
+
+        path (str): file path
+        method (str): "stat" (fast) or "hash" (robust to touched but unchanged files)
+
+    Returns
+
+        fingerprint (str)
+    """
+    if method == "stat":
+        st = os.stat(path)
+        return f"{st.st_mtime_ns}:{st.st_size}"
+    elif method == "hash":
+        m = hashlib.sha256()
+        with open(path, 'rb') as inf:
+            for chunk in iter(lambda: inf.read(1 << 20), b""):
+                m.update(chunk)
+        return m.hexdigest()
+    raise ValueError(f"Unknown fingerprint method: {method}")
+
+
+def load_manifest(tei_location):
+    """
+    Load the build manifest of a TEI location. Returns an empty manifest if there is none.
+
+    Args
+
+        tei_location (str): root of a TEI repository (the one holding the `data/` dir)
+
+    Returns
+
+        manifest (dict)
+    """
+    try:
+        with open(f"{tei_location}/{BUILD_MANIFEST}", 'r') as inf:
+            return json.load(inf)
+    except FileNotFoundError:
+        return {}
+
+
+def write_manifest(tei_location, manifest):
+    """
+    Write the build manifest of a TEI location atomically.
+
+    Args
+
+        tei_location (str): root of a TEI repository
+        manifest (dict): manifest to write
+    """
+    atomic_write(f"{tei_location}/{BUILD_MANIFEST}", json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+
+
+def group_alto_files(alto_files):
+    """
+    Group ALTO page files by the document (directory) they belong to.
+
+    Args
+
+        alto_files (list): ALTO file paths, e.g. args.alto_files
+
+    Returns
+
+        dict {document_dir: [page_file, page_file...]}
+    """
+    documents = {}
+    for f in alto_files:
+        documents.setdefault(os.path.dirname(f), []).append(f)
+    return {k: sorted(v) for k,v in documents.items()}
+
+
+def _location_pairs(config):
+    """
+    Pair each ALTO location in the config with the TEI location of the same collection.
+    """
+    pairs = {}
+    for k,v in vars(config).items():
+        if "ALTO" in k and v is not None:
+            tei_location = getattr(config, k.replace("ALTO", "TEI"), None)
+            if tei_location is not None:
+                pairs[os.path.abspath(v)] = os.path.abspath(tei_location)
+    return pairs
+
+
+def plan_rebuild(args, settings=None, method="stat", force=False):
+    """
+    Plan which TEI documents need to be rebuilt from ALTO.
+
+    A document is planned when its TEI file doesn't exist, it isn't in the build manifest,
+    or the ALTO inputs, valtiopy version or settings hash differ from the last build.
+
+    Args
+
+        args: Argparse args processed by `valtiopy.args.impute_arg_values` with "alto" in `--docformats`
+        settings (dict): conversion settings, hashed into the plan
+        method (str): fingerprint method passed to `fingerprint_file`
+        force (bool): plan every selected document
+
+    Returns
+
+        list of dicts with the keys "filename", "key", "alto_files", "tei_location", "tei_path", "inputs" and "reasons"
+    """
+    if not hasattr(args, "alto_files"):
+        raise ValueError("No ALTO files are selected. Pass `alto` in --docformats.")
+    version = valtiopy_version()
+    s_hash = settings_hash(settings)
+    pairs = _location_pairs(args.config)
+    manifests = {}
+    plan = []
+    for doc_dir, files in group_alto_files(args.alto_files).items():
+        abs_dir = os.path.abspath(doc_dir)
+        alto_location = [_ for _ in pairs if abs_dir.startswith(_ + os.sep)]
+        if len(alto_location) == 0:
+            if args.verbose: print(f"INFO: no TEI location configured for {doc_dir}, skipping")
+            continue
+        alto_location = max(alto_location, key=len)
+        tei_location = pairs[alto_location]
+        rel = os.path.relpath(abs_dir, alto_location)
+        filename = os.path.basename(abs_dir)
+        tei_path = f"{tei_location}/{rel}.xml"
+
+        if tei_location not in manifests:
+            manifests[tei_location] = load_manifest(tei_location)
+        record = manifests[tei_location].get(rel)
+        inputs = {os.path.basename(f): fingerprint_file(f, method=method) for f in files}
+
+        reasons = []
+        if force:
+            reasons.append("forced")
+        if not os.path.exists(tei_path):
+            reasons.append("missing")
+        if record is None:
+            reasons.append("untracked")
+        else:
+            if record.get("inputs") != inputs:
+                reasons.append("inputs")
+            if record.get("version") != version:
+                reasons.append("version")
+            if record.get("settings") != s_hash:
+                reasons.append("settings")
+        if len(reasons) > 0:
+            plan.append({
+                "filename": filename,
+                "key": rel,
+                "alto_files": files,
+                "tei_location": tei_location,
+                "tei_path": tei_path,
+                "inputs": inputs,
+                "reasons": reasons,
+            })
+    if args.verbose: print(f"INFO: {len(plan)} documents planned for rebuilding")
+    return plan
+
+
+def dry_run_report(plan):
+    """
+    Summarize a rebuild plan without building anything.
+
+    Args
+
+        plan (list): output of `plan_rebuild`
+
+    Returns
+
+        report (str)
+    """
+    counts = {}
+    lines = []
+    for item in plan:
+        for reason in item["reasons"]:
+            counts[reason] = counts.get(reason, 0) + 1
+        lines.append(f"{item['tei_path']}  ({', '.join(item['reasons'])}, {len(item['alto_files'])} pages)")
+    summary = ", ".join(f"{k}: {v}" for k,v in sorted(counts.items()))
+    lines.append(f"{len(plan)} documents to rebuild" + (f" -- {summary}" if summary else ""))
+    return "\n".join(lines)
+
+
+def rebuild(plan, settings=None, processes=None, verbose=False):
+    """
+    Rebuild the planned documents with `valtiopy.pipeline.convert_documents` and record them in the build manifest.
+
+    Args
+
+        plan (list): output of `plan_rebuild`
+        settings (dict): conversion settings, must be the same as passed to `plan_rebuild`
+        processes (int): number of conversion worker processes (default: number of CPUs)
+        verbose (bool): print stuff
+    """
+    version = valtiopy_version()
+    s_hash = settings_hash(settings)
+    settings = conversion_settings(settings)
+    items = {item["tei_path"]: item for item in plan}
+    manifests = {}
+    # TEI locations of the documents that aren't in the written manifests yet
+    pending = []
+
+    def on_result(tei_path):
+        item = items[tei_path]
+        tei_location = item["tei_location"]
+        if tei_location not in manifests:
+            manifests[tei_location] = load_manifest(tei_location)
+        manifests[tei_location][item["key"]] = {
+            "inputs": item["inputs"],
+            "version": version,
+            "settings": s_hash,
+        }
+        pending.append(tei_location)
+        # written every SAVE_EVERY documents so that an interrupted run keeps most of what was built
+        if len(pending) >= SAVE_EVERY:
+            for location in set(pending):
+                write_manifest(location, manifests[location])
+            pending.clear()
+
+    try:
+        convert_documents([(item, item["tei_path"]) for item in plan], compute_workers=processes,
+                          ordered=False, on_result=on_result, verbose=verbose, **settings)
+    finally:
+        for location in set(pending):
+            write_manifest(location, manifests[location])
+
+
+
+
+if __name__ == '__main__':
+    from valtiopy.args import (
+        fetch_parser,
+        impute_arg_values,
+        reject_unsupported,
+    )
+    parser = fetch_parser(description=__doc__)
+    parser.add_argument("--dry-run",
+                        action = 'store_true',
+                        help = "Only print the rebuild plan")
+    parser.add_argument("--hash",
+                        action = 'store_true',
+                        help = "Fingerprint ALTO files by content hash instead of mtime and size")
+    parser.add_argument("--force",
+                        action = 'store_true',
+                        help = "Rebuild every selected document")
+    parser.add_argument("--padding",
+                        type = int,
+                        default = DEFAULT_SETTINGS["padding"],
+                        help = "Indentation of the written TEI")
+    args = parser.parse_args()
+    reject_unsupported(parser, args, "chunksize", "resume")
+    if "alto" not in args.docformats:
+        args.docformats.append("alto")
+    args = impute_arg_values(args)
+    settings = {"padding": args.padding}
+    plan = plan_rebuild(args, settings=settings, method="hash" if args.hash else "stat", force=args.force)
+    print(dry_run_report(plan))
+    if not args.dry_run:
+        rebuild(plan, settings=settings, processes=args.jobs, verbose=args.verbose)
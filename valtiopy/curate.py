@@ -4,6 +4,8 @@ Functions for curating the Valtiopaivat Corpus from scanned, OCRed image files
 from lxml import etree
 from pyparlaclarin.create import pc_header
 from pyriksdagen.download import _alto_extract_paragraphs
+from valtiopy import instrument
+from valtiopy.document import Document
 from valtiopy.utils import (
     get_formatted_uuid,
     parse_tei,
@@ -12,12 +14,38 @@ from valtiopy.utils import (
     XML_NS,
 )
 import alto
-import copy
 import os
 
 
 
 
+COLLECTIONS = {
+    "prot": "records",
+    "ptk": "records",
+    "hand": "handlingar",
+    "ask": "handlingar",
+    "bil": "handlingar",
+    "reg": "register",
+    "sis": "register"
+}
+
+
+def pb_facs(metadata, nr):
+    """
+    Return the facsimile URL of a page
+
+    Args
+
+        metadata (dict): document metadata (see `valtiopy.utils.infer_metadata`)
+        nr (str): page number as in the ALTO filename
+
+    Return
+
+        url (str)
+    """
+    return f"https://swerik-project.github.io/valtiopaivat-{COLLECTIONS[metadata['document_type']]}-pdf/{metadata['yearstr']}/{metadata['filename']}-{nr}.pdf"
+
+
 def convert_alto(files):
     """
     Convert a list of alto files to a dict
@@ -41,39 +69,59 @@ def convert_alto(files):
 
         nr = file_.split('-')[-1].replace('.xml', '')
         try:
-            altofile = alto.parse_file(file_)
+            with instrument.timer("alto.parse_file"):
+                altofile = alto.parse_file(file_)
+            if instrument.is_enabled():
+                instrument.add_bytes("alto.parse_file", read=os.path.getsize(file_))
         except:
             print("OOOPS", file_)
             raise Error("sth isn't right")
-        pp = _alto_extract_paragraphs(altofile)
+        with instrument.timer("_alto_extract_paragraphs"):
+            pp = _alto_extract_paragraphs(altofile)
         paragraphs[nr] = pp
     return paragraphs
 
 
+def alto_to_document(files, filename=None):
+    """
+    Convert the ALTO pages of a document to a `valtiopy.document.Document`
+
+    Args
+
+        files: (list) the document's alto file paths, in page order
+        filename (str): document name, defaults to the name of the directory of the files
+
+    Return
+
+        document (Document)
+    """
+    if filename is None:
+        filename = os.path.basename(os.path.dirname(os.path.abspath(files[0])))
+    return Document.from_filename(filename, convert_alto(files))
+
+
+@instrument.timed("dict_to_tei")
 def dict_to_tei(data, verbose=False):
     """
-    Convert a metadata dict into a TEI XML tree
+    Convert a document into a TEI XML tree
 
     Args
 
-        data (dict): dictionary containing protocol level metadata
+        data (Document or dict): a `valtiopy.document.Document`, or a dictionary containing protocol level metadata and a "paragraphs" key
         verbose (bool): print stuff
 
     Return
 
         tei (lxml.etree.Element): the protocol as a TEI-formatted lxml tree root
     """
-    if verbose: ptint(f"INFO: Preparing tei")
-    metadata = copy.deepcopy(data)
-    dt = {
-        "prot": "records",
-        "ptk": "records",
-        "hand": "handlingar",
-        "ask": "handlingar",
-        "bil": "handlingar",
-        "reg": "register",
-        "sis": "register"
-    }
+    if verbose: print(f"INFO: Preparing tei")
+    if isinstance(data, Document):
+        metadata = data.metadata()
+        pages = data.items()
+    else:
+        # shallow, the paragraphs aren't needed in the header
+        metadata = {k: v for k, v in data.items() if k != "paragraphs"}
+        pages = data["paragraphs"].items()
     nsmap = {None: TEI_NS}
     nsmap = {key: value.replace("{", "").replace("}", "") for key,value in nsmap.items()}
     tei = etree.Element("TEI", nsmap=nsmap)
@@ -102,39 +150,39 @@ def dict_to_tei(data, verbose=False):
     protocol_id = metadata["filename"]
     element_seed = f"{protocol_id}\nNA\n"
     print(element_seed)
-    for nr, pp in data["paragraphs"].items():
+    tag = "note" if metadata["document_type"] in ["ptk", "prot"] else "p"
+    for nr, pp in pages:
         pb = etree.SubElement(body_div, "pb")
-        pb.attrib["facs"] = f"https://swerik-project.github.io/valtiopaivat-{dt[metadata['document_type']]}-pdf/{metadata['yearstr']}/{metadata['filename']}-{nr}.pdf"
+        pb.attrib["facs"] = pb_facs(metadata, nr)
         for paragraph in pp:
-            if metadata["document_type"] in ["ptk", "prot"]:
-                elem = etree.SubElement(body_div, "note")
-            else:
-                elem = etree.SubElement(body_div, "p")
+            elem = etree.SubElement(body_div, tag)
             elem.text = paragraph
             element_seed += paragraph
-            elem.attrib[f"{XML_NS}id"] = get_formatted_uuid(element_seed)
+            with instrument.timer("get_formatted_uuid"):
+                elem.attrib[f"{XML_NS}id"] = get_formatted_uuid(element_seed)
 
     return tei
 
 
 
-def dict_to_parlaclarin(data, tei_loc, verbose=False):
+def dict_to_parlaclarin(data, tei_loc, verbose=False, padding=8):
     """
     Create per-protocol parlaclarin files of all files provided in file_db.
     Does not return anything, instead writes the data on disk.
 
     Args:
 
-        data (dict): metadata and data
+        data (Document or dict): metadata and data, see `dict_to_tei`
         tei_loc (str): path to tei
         verbose (bool): print stuff
+        padding (int): passed to `write_tei`
     """
     parlaclarin_path = f"{tei_loc}/{data['filename']}.xml"
     if verbose: print(f"INFO: preparing to write tei to {parlaclarin_path}")
     tei = dict_to_tei(data)
     if verbose: print("INFO: TEI OK... write and read-write test")
     os.makedirs(tei_loc, exist_ok=True)
-    write_tei(tei, parlaclarin_path)
+    write_tei(tei, parlaclarin_path, padding=padding)
     root, ns = parse_tei(parlaclarin_path)
-    write_tei(root, parlaclarin_path)
+    write_tei(root, parlaclarin_path, padding=padding)
     if verbose: print("INFO:    OK")
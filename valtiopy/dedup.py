@@ -0,0 +1,378 @@
+"""
+Find near-duplicate pages or paragraphs in the corpus.
+
+Texts are split in character shingles, which are hashed and reduced to MinHash signatures with numpy.
+Candidate pairs are found with locality-sensitive hashing: signatures are cut in bands and only texts
+sharing a band are compared, instead of comparing all pairs. Candidates with an estimated Jaccard
+similarity above the threshold are grouped into clusters.
+
+    keys, signatures = compute_document_signatures(args.tei_files, tei_units)
+    pairs = find_candidates(signatures, keys, threshold=0.8)
+    clusters = cluster_pairs(pairs)
+
+Documents are read in the worker processes, only their paths are sent to the workers.
+"""
+from multiprocessing import Pool
+from numpy.lib.stride_tricks import sliding_window_view
+from valtiopy.build import group_alto_files
+from valtiopy.curate import alto_to_document
+from valtiopy.utils import (
+    infer_metadata,
+    iter_tei_paragraphs,
+)
+import functools
+import numpy as np
+import os
+import pandas as pd
+
+
+
+
+PRIME = np.uint64(4294967291)  # largest prime < 2**32, keeps signatures in uint32
+SHINGLE_BASE = np.uint64(1099511628211)
+
+
+@functools.lru_cache(maxsize=None)
+def _permutations(num_perm, seed):
+    # cached per process, the arrays are only read
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(PRIME), size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, int(PRIME), size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def shingle_hashes(text, k=5):
+    """
+    Hash the character k-shingles of a text.
+
+    Args
+
+        text (str): a text, lower cased and whitespace normalized before shingling
+        k (int): shingle length
+
+    Returns
+
+        np.ndarray of unique uint64 hashes, reduced modulo `PRIME`. Empty if the text is shorter than k.
+    """
+    text = " ".join(text.lower().split())
+    cp = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(cp) < k:
+        return np.empty(0, dtype=np.uint64)
+    powers = SHINGLE_BASE ** np.arange(k - 1, -1, -1, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        h = (sliding_window_view(cp, k) * powers).sum(axis=1, dtype=np.uint64)
+    return np.unique(h % PRIME)
+
+
+def minhash(text, num_perm=64, k=5, seed=0):
+    """
+    Compute the MinHash signature of a text
+
+    Args
+
+        text (str): the text
+        num_perm (int): signature length
+        k (int): shingle length
+        seed (int): seed of the hash permutations, must be the same for signatures that are compared
+
+    Returns
+
+        np.ndarray (num_perm,) of uint32, None if the text is shorter than k
+    """
+    h = shingle_hashes(text, k=k)
+    if len(h) == 0:
+        return None
+    a, b = _permutations(num_perm, seed)
+    # a, h < 2**32 so a * h + b fits in uint64
+    return ((a[:, None] * h[None, :] + b[:, None]) % PRIME).min(axis=1).astype(np.uint32)
+
+
+def _signature(item, num_perm, k, seed):
+    key, text = item
+    return key, minhash(text, num_perm=num_perm, k=k, seed=seed)
+
+
+def compute_signatures(units, num_perm=64, k=5, seed=0, processes=None, chunksize=256):
+    """
+    Compute MinHash signatures in a process pool
+
+    Args
+
+        units (iterable): (key, text) tuples, e.g. from `iter_alto_pages` or `iter_tei_units`
+        num_perm (int): signature length
+        k (int): shingle length
+        seed (int): permutation seed
+        processes (int): number of worker processes (default: number of CPUs)
+        chunksize (int): texts sent to a worker at a time
+
+    Returns
+
+        keys (list), signatures (np.ndarray (n, num_perm) of uint32). Texts shorter than k are left out.
+    """
+    keys = []
+    signatures = []
+    func = functools.partial(_signature, num_perm=num_perm, k=k, seed=seed)
+    with Pool(processes=processes) as pool:
+        for key, sig in pool.imap(func, units, chunksize=chunksize):
+            if sig is not None:
+                keys.append(key)
+                signatures.append(sig)
+    if len(signatures) == 0:
+        return keys, np.empty((0, num_perm), dtype=np.uint32)
+    return keys, np.vstack(signatures)
+
+
+def _document_signatures(document, units, num_perm, k, seed):
+    return [(key, minhash(text, num_perm=num_perm, k=k, seed=seed)) for key, text in units(document)]
+
+
+def compute_document_signatures(documents, units, num_perm=64, k=5, seed=0, processes=None, chunksize=1):
+    """
+    Compute MinHash signatures in a process pool, reading the documents in the workers
+
+    Args
+
+        documents (iterable): documents, e.g. TEI file paths or the items of `valtiopy.build.group_alto_files`
+        units (callable): document -> iterable of (key, text) tuples, e.g. `tei_units` or `alto_pages`. Must be picklable (module level)
+        num_perm (int): signature length
+        k (int): shingle length
+        seed (int): permutation seed
+        processes (int): number of worker processes (default: number of CPUs)
+        chunksize (int): documents sent to a worker at a time
+
+    Returns
+
+        keys (list), signatures (np.ndarray (n, num_perm) of uint32), in the order of the documents. Texts shorter than k are left out.
+    """
+    keys = []
+    signatures = []
+    func = functools.partial(_document_signatures, units=units, num_perm=num_perm, k=k, seed=seed)
+    with Pool(processes=processes) as pool:
+        for results in pool.imap(func, documents, chunksize=chunksize):
+            for key, sig in results:
+                if sig is not None:
+                    keys.append(key)
+                    signatures.append(sig)
+    if len(signatures) == 0:
+        return keys, np.empty((0, num_perm), dtype=np.uint32)
+    return keys, np.vstack(signatures)
+
+
+def _band_groups(signatures, bands):
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    for band in range(bands):
+        sl = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        keys = sl.view(np.dtype((np.void, sl.dtype.itemsize * rows))).ravel()
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+        members = np.flatnonzero(counts[inverse] > 1)
+        if len(members) == 0:
+            continue
+        members = members[np.argsort(inverse[members], kind="stable")]
+        bounds = np.flatnonzero(np.diff(inverse[members])) + 1
+        for group in np.split(members, bounds):
+            yield group
+
+
+def find_candidates(signatures, keys=None, bands=16, threshold=0.8, max_bucket_size=100):
+    """
+    Find near-duplicate pairs with LSH banding.
+
+    Args
+
+        signatures (np.ndarray): output of `compute_signatures`
+        keys (list): keys of the signatures (default: row numbers)
+        bands (int): number of bands, must divide the signature length. More bands find less similar pairs.
+        threshold (float): minimum estimated Jaccard similarity of a reported pair
+        max_bucket_size (int): buckets larger than this are compared to their first member only, instead of all pairs
+
+    Returns
+
+        pd.DataFrame with the columns "a", "b" and "similarity"
+    """
+    if signatures.shape[1] % bands != 0:
+        raise ValueError(f"The signature length {signatures.shape[1]} is not divisible by {bands} bands")
+    candidates = set()
+    for group in _band_groups(signatures, bands):
+        if len(group) <= max_bucket_size:
+            ix = np.triu_indices(len(group), k=1)
+            left, right = group[ix[0]], group[ix[1]]
+        else:
+            left, right = np.full(len(group) - 1, group[0]), group[1:]
+        candidates.update(zip(np.minimum(left, right).tolist(), np.maximum(left, right).tolist()))
+
+    if len(candidates) == 0:
+        return pd.DataFrame({"a": [], "b": [], "similarity": []})
+    pairs = np.array(sorted(candidates))
+    similarity = (signatures[pairs[:, 0]] == signatures[pairs[:, 1]]).mean(axis=1)
+    keep = similarity >= threshold
+    pairs, similarity = pairs[keep], similarity[keep]
+    if keys is not None:
+        a = [keys[_] for _ in pairs[:, 0]]
+        b = [keys[_] for _ in pairs[:, 1]]
+    else:
+        a, b = pairs[:, 0], pairs[:, 1]
+    return pd.DataFrame({"a": a, "b": b, "similarity": similarity})
+
+
+def cluster_pairs(pairs):
+    """
+    Group near-duplicate pairs into clusters (connected components)
+
+    Args
+
+        pairs (pd.DataFrame): output of `find_candidates`
+
+    Returns
+
+        pd.DataFrame with the columns "cluster", "key", "size" and "max_similarity" (to any other member)
+    """
+    parent = {}
+
+    def _find(x):
+        parent.setdefault(x, x)
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    best = {}
+    for a, b, s in zip(pairs["a"], pairs["b"], pairs["similarity"]):
+        ra, rb = _find(a), _find(b)
+        if ra != rb:
+            parent[rb] = ra
+        best[a] = max(best.get(a, 0), s)
+        best[b] = max(best.get(b, 0), s)
+
+    rows = [(_find(key), key, best[key]) for key in parent]
+    df = pd.DataFrame(rows, columns=["root", "key", "max_similarity"])
+    df["size"] = df.groupby("root")["key"].transform("count")
+    df["cluster"] = df.groupby("root", sort=False).ngroup()
+    return df[["cluster", "key", "size", "max_similarity"]].sort_values(["cluster"]).reset_index(drop=True)
+
+
+def alto_pages(document):
+    """
+    Yield the pages of an ALTO document for deduplication
+
+    Args
+
+        document (tuple): (document_dir, page files), an item of `valtiopy.build.group_alto_files`
+
+    Yields
+
+        ((document, page), text) tuples
+    """
+    doc_dir, files = document
+    document = alto_to_document(files, os.path.basename(doc_dir))
+    for page in document.pages:
+        yield (document.filename, page.nr), "\n".join(page.paragraphs)
+
+
+def iter_alto_pages(alto_files):
+    """
+    Yield the pages of ALTO documents for deduplication
+
+    Args
+
+        alto_files (list): ALTO page files, e.g. args.alto_files
+
+    Yields
+
+        ((document, page), text) tuples
+    """
+    for document in group_alto_files(alto_files).items():
+        yield from alto_pages(document)
+
+
+def tei_units(tei_file, level="page"):
+    """
+    Yield the pages or paragraphs of a TEI document for deduplication
+
+    Args
+
+        tei_file (str): path to a TEI file
+        level (str): "page" or "paragraph"
+
+    Yields
+
+        ((document, page), text) tuples at page level, ((document, xml_id), text) at paragraph level.
+        The page is None for text before the first `pb`, paragraphs without an `xml:id` get their position ("#<i>").
+    """
+    document = infer_metadata(tei_file)["filename"]
+    page, texts = None, []
+    for i, row in enumerate(iter_tei_paragraphs(tei_file, tags=("note", "p", "seg"))):
+        if row["text"] is None:
+            continue
+        if level == "paragraph":
+            yield (document, row["xml_id"] if row["xml_id"] is not None else f"#{i}"), row["text"]
+        elif row["page"] != page:
+            if len(texts) > 0:
+                yield (document, page), "\n".join(texts)
+            page, texts = row["page"], []
+        texts.append(row["text"])
+    if level == "page" and len(texts) > 0:
+        yield (document, page), "\n".join(texts)
+
+
+def iter_tei_units(tei_files, level="page"):
+    """
+    Yield the pages or paragraphs of TEI documents for deduplication
+
+    Args
+
+        tei_files (list): TEI files, e.g. args.tei_files
+        level (str): "page" or "paragraph"
+
+    Yields
+
+        see `tei_units`
+    """
+    for tei_file in tei_files:
+        yield from tei_units(tei_file, level=level)
+
+
+
+
+if __name__ == '__main__':
+    from valtiopy.args import (
+        fetch_parser,
+        impute_arg_values,
+        reject_unsupported,
+    )
+    parser = fetch_parser(description=__doc__)
+    parser.add_argument("--level",
+                        choices = ["page", "paragraph"],
+                        default = "page",
+                        help = "Compare pages or paragraphs")
+    parser.add_argument("--threshold",
+                        type = float,
+                        default = 0.8,
+                        help = "Minimum estimated Jaccard similarity")
+    parser.add_argument("--num-perm",
+                        type = int,
+                        default = 64,
+                        help = "MinHash signature length")
+    parser.add_argument("--bands",
+                        type = int,
+                        default = 16,
+                        help = "LSH bands")
+    parser.add_argument("-o", "--out-prefix",
+                        default = "duplicates",
+                        help = "Write <prefix>-pairs.csv and <prefix>-clusters.csv")
+    args = parser.parse_args()
+    reject_unsupported(parser, args, "resume")
+    args = impute_arg_values(args)
+    if "tei" in args.docformats:
+        documents, units = args.tei_files, functools.partial(tei_units, level=args.level)
+    else:
+        documents, units = list(group_alto_files(args.alto_files).items()), alto_pages
+    keys, signatures = compute_document_signatures(documents, units, num_perm=args.num_perm,
+                                                   processes=args.jobs, chunksize=args.chunksize or 1)
+    keys = ["|".join("" if part is None else str(part) for part in key) for key in keys]
+    pairs = find_candidates(signatures, keys, bands=args.bands, threshold=args.threshold)
+    clusters = cluster_pairs(pairs)
+    pairs.to_csv(f"{args.out_prefix}-pairs.csv", index=False)
+    clusters.to_csv(f"{args.out_prefix}-clusters.csv", index=False)
+    if args.verbose: print(f"INFO: {len(pairs)} pairs in {clusters['cluster'].nunique()} clusters")
@@ -0,0 +1,259 @@
+"""
+Compare two TEI builds of the corpus.
+
+Files are matched by their path relative to the corpus roots and compared by content hash first.
+Hashes are cached with the mtime and size of the file (`HASH_CACHE`), so unchanged files aren't read
+again on the next comparison. Only files whose hashes differ are parsed: their text elements are
+aligned by `xml:id` and reported as added, removed or modified, and their `pb`s are compared by page.
+Files that differ in formatting only are reported as such.
+
+    python -m valtiopy.diff old/valtiopaivat-records new/valtiopaivat-records -j 8 -o diff
+
+writes `diff-summary.json` and one line per changed document to `diff-documents.jsonl`.
+"""
+from glob import glob
+from lxml import etree
+from multiprocessing import Pool
+from valtiopy.build import fingerprint_file
+from valtiopy.utils import iter_tei_paragraphs
+import argparse
+import json
+import os
+
+
+
+
+HASH_CACHE = ".valtiopy-hashes.json"
+DIFF_TAGS = ("pb", "note", "p", "u", "seg")
+
+
+def tei_files(root):
+    """
+    Return the XML files under a corpus root, relative to the root
+
+    Args
+
+        root (str): corpus root, e.g. a TEI location
+
+    Returns
+
+        sorted list of relative paths
+    """
+    return sorted(os.path.relpath(f, root) for f in glob(f"{root}/**/*.xml", recursive=True))
+
+
+def load_hash_cache(cache_path=HASH_CACHE):
+    """
+    Load the hash cache. Returns an empty cache if there is none.
+
+    Args
+
+        cache_path (str): path to the cache
+
+    Returns
+
+        dict {absolute path: {"stat": ..., "sha256": ...}}
+    """
+    try:
+        with open(cache_path, 'r') as inf:
+            return json.load(inf)
+    except FileNotFoundError:
+        return {}
+
+
+def _hash(path):
+    return path, fingerprint_file(path, method="stat"), fingerprint_file(path, method="hash")
+
+
+def hash_files(paths, cache, processes=None):
+    """
+    Return the content hashes of files, reading only the files that changed since they were cached
+
+    Args
+
+        paths (list): file paths
+        cache (dict): hash cache, updated in place
+        processes (int): number of worker processes (default: number of CPUs)
+
+    Returns
+
+        dict {path: sha256}
+    """
+    hashes = {}
+    todo = []
+    for path in paths:
+        entry = cache.get(os.path.abspath(path))
+        if entry is not None and entry["stat"] == fingerprint_file(path, method="stat"):
+            hashes[path] = entry["sha256"]
+        else:
+            todo.append(path)
+    if len(todo) > 0:
+        with Pool(processes=processes) as pool:
+            for path, stat, sha in pool.imap_unordered(_hash, todo, chunksize=16):
+                cache[os.path.abspath(path)] = {"stat": stat, "sha256": sha}
+                hashes[path] = sha
+    return hashes
+
+
+def _elements(path):
+    paragraphs, pbs = {}, {}
+    for i, row in enumerate(iter_tei_paragraphs(path, tags=DIFF_TAGS)):
+        if row["tag"] == "pb":
+            pbs[row["page"] if row["page"] is not None else row["facs"]] = row
+        else:
+            # elements without an id are aligned by position
+            paragraphs[row["xml_id"] if row["xml_id"] is not None else f"#{i}"] = row
+    return paragraphs, pbs
+
+
+def diff_file(old_path, new_path):
+    """
+    Compare the text elements and page breaks of two versions of a TEI file
+
+    Args
+
+        old_path (str): TEI file of the old build
+        new_path (str): TEI file of the new build
+
+    Returns
+
+        dict with the keys
+        "paragraphs": {"added": [xml_id...], "removed": [xml_id...], "modified": [{"xml_id", "fields", "old", "new"}...]} and
+        "pb": {"added": [page...], "removed": [page...], "modified": [{"page", "old", "new"}...]}
+    """
+    old, old_pbs = _elements(old_path)
+    new, new_pbs = _elements(new_path)
+    modified = []
+    for xml_id in old.keys() & new.keys():
+        fields = [k for k in ["tag", "page", "parent_id", "text"] if old[xml_id][k] != new[xml_id][k]]
+        if len(fields) > 0:
+            modified.append({
+                "xml_id": xml_id,
+                "fields": fields,
+                "old": {k: old[xml_id][k] for k in fields},
+                "new": {k: new[xml_id][k] for k in fields},
+            })
+    pb_modified = [
+        {"page": page, "old": old_pbs[page]["facs"], "new": new_pbs[page]["facs"]}
+        for page in old_pbs.keys() & new_pbs.keys() if old_pbs[page]["facs"] != new_pbs[page]["facs"]
+    ]
+    return {
+        "paragraphs": {
+            "added": [k for k in new if k not in old],
+            "removed": [k for k in old if k not in new],
+            "modified": sorted(modified, key=lambda x: x["xml_id"]),
+        },
+        "pb": {
+            "added": [k for k in new_pbs if k not in old_pbs],
+            "removed": [k for k in old_pbs if k not in new_pbs],
+            "modified": sorted(pb_modified, key=lambda x: x["page"]),
+        },
+    }
+
+
+def _diff(item):
+    document, old_path, new_path = item
+    try:
+        details = diff_file(old_path, new_path)
+    except etree.XMLSyntaxError as e:
+        # lxml errors can't be sent back from the workers
+        return {"document": document, "status": "error", "error": str(e)}
+    changed = any(len(v) > 0 for part in details.values() for v in part.values())
+    return {"document": document, "status": "modified" if changed else "formatting", **details}
+
+
+def diff_corpus(old_root, new_root, cache_path=HASH_CACHE, processes=None, verbose=False):
+    """
+    Compare two corpus roots
+
+    Args
+
+        old_root (str): root of the old build
+        new_root (str): root of the new build
+        cache_path (str): hash cache, shared by both roots
+        processes (int): number of worker processes (default: number of CPUs)
+        verbose (bool): print stuff
+
+    Returns
+
+        summary (dict), details (list of dicts, one per added, removed, modified, reformatted or unparseable document)
+    """
+    old_files, new_files = set(tei_files(old_root)), set(tei_files(new_root))
+    common = sorted(old_files & new_files)
+    details = [{"document": f, "status": "removed"} for f in old_files - new_files]
+    details += [{"document": f, "status": "added"} for f in new_files - old_files]
+
+    cache = load_hash_cache(cache_path)
+    old_hashes = hash_files([f"{old_root}/{f}" for f in common], cache, processes=processes)
+    new_hashes = hash_files([f"{new_root}/{f}" for f in common], cache, processes=processes)
+    tmp = f"{cache_path}.{os.getpid()}.tmp"
+    with open(tmp, 'w+') as outf:
+        json.dump(cache, outf)
+    os.replace(tmp, cache_path)
+
+    changed = [(f, f"{old_root}/{f}", f"{new_root}/{f}") for f in common
+               if old_hashes[f"{old_root}/{f}"] != new_hashes[f"{new_root}/{f}"]]
+    if verbose: print(f"INFO: {len(common)} files in both builds, {len(changed)} with different content")
+    if len(changed) > 0:
+        with Pool(processes=processes) as pool:
+            details += pool.imap_unordered(_diff, changed, chunksize=4)
+    details = sorted(details, key=lambda x: x["document"])
+
+    summary = {
+        "old_root": os.path.abspath(old_root),
+        "new_root": os.path.abspath(new_root),
+        "documents": {"unchanged": len(common) - len(changed), "added": 0, "removed": 0, "modified": 0, "formatting": 0, "error": 0},
+        "paragraphs": {"added": 0, "removed": 0, "modified": 0},
+        "pb": {"added": 0, "removed": 0, "modified": 0},
+    }
+    for d in details:
+        summary["documents"][d["status"]] += 1
+        for part in ["paragraphs", "pb"]:
+            for k, v in d.get(part, {}).items():
+                summary[part][k] += len(v)
+    if verbose: print(f"INFO: {summary['documents']}")
+    return summary, details
+
+
+def write_diff(summary, details, out_prefix="diff"):
+    """
+    Write a diff to `<out_prefix>-summary.json` and `<out_prefix>-documents.jsonl`
+
+    Args
+
+        summary (dict): output of `diff_corpus`
+        details (list): output of `diff_corpus`
+        out_prefix (str): path prefix of the output files
+    """
+    with open(f"{out_prefix}-summary.json", 'w+') as outf:
+        json.dump(summary, outf, indent=2)
+    with open(f"{out_prefix}-documents.jsonl", 'w+') as outf:
+        for d in details:
+            outf.write(json.dumps(d, ensure_ascii=False) + "\n")
+
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old_root",
+                        help = "Root of the old build")
+    parser.add_argument("new_root",
+                        help = "Root of the new build")
+    parser.add_argument("-o", "--out-prefix",
+                        default = "diff",
+                        help = "Write <prefix>-summary.json and <prefix>-documents.jsonl")
+    parser.add_argument("--hash-cache",
+                        default = HASH_CACHE,
+                        help = "Cache of file content hashes")
+    parser.add_argument("-j", "--jobs",
+                        type = int,
+                        default = None,
+                        help = "Number of worker processes (default: number of CPUs)")
+    parser.add_argument("-v", "--verbose",
+                        action = 'store_true',
+                        help = "Print extra information about what's going on")
+    args = parser.parse_args()
+    summary, details = diff_corpus(args.old_root, args.new_root, cache_path=args.hash_cache, processes=args.jobs, verbose=args.verbose)
+    write_diff(summary, details, out_prefix=args.out_prefix)
+    print(json.dumps(summary, indent=2))
@@ -0,0 +1,132 @@
+"""
+A compact in-memory document model between ALTO and TEI.
+
+A `Document` carries the metadata inferred from the filename and a list of `Page`s, each holding
+the paragraph strings of a page. Both use `__slots__`, and paragraph lists are referenced, never
+copied, so a document costs little more than its text. `dict_to_tei`, the page store and the
+pipeline accept documents as well as the older `{"paragraphs": {page: [...]}, **metadata}` dicts.
+"""
+from valtiopy.utils import infer_metadata
+
+
+
+
+class Page:
+    """
+    A page of a document
+
+    Args
+
+        nr (str): page number, as in the ALTO filename
+        paragraphs (list): paragraph strings
+    """
+    __slots__ = ("nr", "paragraphs")
+
+    def __init__(self, nr, paragraphs):
+        self.nr = nr
+        self.paragraphs = paragraphs
+
+    def __repr__(self):
+        return f"Page({self.nr!r}, {len(self.paragraphs)} paragraphs)"
+
+
+class Document:
+    """
+    A corpus document: metadata and pages
+
+    Args
+
+        filename (str): document name, e.g. "prot_1877_adeln_II"
+        document_type (str): doctype, e.g. "prot"
+        chamber (str): capitalized chamber, None if it isn't in the filename
+        yearstr (str): year part of the filename, e.g. "1877-1878"
+        year (str): first year
+        secondary_year (str): second year, None if there isn't one
+        number (str): number of the document
+        date (str): date of the document, optional
+        pages (list): Page objects
+    """
+    __slots__ = ("filename", "document_type", "chamber", "yearstr", "year", "secondary_year", "number", "date", "pages")
+    METADATA = ("filename", "document_type", "chamber", "yearstr", "year", "secondary_year", "number", "date")
+
+    def __init__(self, filename, document_type, chamber, yearstr, year, secondary_year, number, date=None, pages=None):
+        self.filename = filename
+        self.document_type = document_type
+        self.chamber = chamber
+        self.yearstr = yearstr
+        self.year = year
+        self.secondary_year = secondary_year
+        self.number = number
+        self.date = date
+        self.pages = pages if pages is not None else []
+
+    @classmethod
+    def from_filename(cls, filename, pages=None):
+        """
+        Create a document with metadata inferred from a filename (see `valtiopy.utils.infer_metadata`)
+
+        Args
+
+            filename (str): document name or path
+            pages (dict or list): {page_nr: [paragraph...]} as returned by `convert_alto`, or Page objects
+        """
+        document = cls(**infer_metadata(filename))
+        if pages is not None:
+            document.set_pages(pages)
+        return document
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create a document from a metadata dict with a "paragraphs" key, as passed to `dict_to_tei`.
+        Keys that aren't document metadata are ignored.
+
+        Args
+
+            data (dict): metadata and paragraphs
+        """
+        document = cls(**{k: data.get(k) for k in cls.METADATA})
+        document.set_pages(data.get("paragraphs", {}))
+        return document
+
+    def set_pages(self, pages):
+        """
+        Set the pages of the document, without copying the paragraphs
+
+        Args
+
+            pages (dict or list): {page_nr: [paragraph...]}, or Page objects
+        """
+        if isinstance(pages, dict):
+            pages = [Page(nr, paragraphs) for nr, paragraphs in pages.items()]
+        self.pages = list(pages)
+
+    def metadata(self):
+        """
+        Return the metadata as a (new, small) dict, in the format of `infer_metadata`
+        """
+        metadata = {k: getattr(self, k) for k in self.METADATA}
+        if metadata["date"] is None:
+            del metadata["date"]
+        return metadata
+
+    def items(self):
+        """
+        Iterate over (page_nr, paragraphs), like the `convert_alto` dict
+        """
+        for page in self.pages:
+            yield page.nr, page.paragraphs
+
+    def __getitem__(self, key):
+        # dict style access for code written against metadata dicts
+        if key == "paragraphs":
+            return dict(self.items())
+        if key not in self.METADATA:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __repr__(self):
+        return f"Document({self.filename!r}, {len(self.pages)} pages)"
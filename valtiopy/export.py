@@ -0,0 +1,211 @@
+"""
+Export TEI files to a Parquet paragraph table.
+
+Every `note`, `p`, `u` and `seg` becomes a row with the document metadata, the page it is on,
+its `xml:id` and its text. The dataset is partitioned by year and document type, with one Parquet
+file per document:
+
+    <out_dir>/year=1877/document_type=prot/prot_1877_adeln_II.parquet
+
+so rebuilt documents are re-exported by replacing their file, and untouched documents are skipped.
+Rows are written in row groups of `batch_size`, so memory use doesn't depend on the size of a document.
+
+Needs pyarrow, which is an optional dependency: `pip install valtiopy[parquet]`.
+"""
+from multiprocessing import Pool
+from valtiopy.utils import (
+    infer_metadata,
+    iter_tei_paragraphs,
+)
+import functools
+import os
+
+
+
+
+COLUMNS = ["document", "chamber", "yearstr", "secondary_year", "number", "page", "tag", "xml_id", "parent_id", "text"]
+
+
+@functools.lru_cache(maxsize=None)
+def schema():
+    """
+    Return the pyarrow schema of the paragraph table, all `COLUMNS` are strings
+    """
+    import pyarrow as pa
+    return pa.schema([(c, pa.string()) for c in COLUMNS])
+
+
+@functools.lru_cache(maxsize=None)
+def partitioning():
+    """
+    Return the hive partitioning of the dataset on year and document type
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ds.partitioning(
+        pa.schema([("year", pa.int16()), ("document_type", pa.string())]),
+        flavor="hive",
+    )
+
+
+def parquet_path(tei_path, out_dir):
+    """
+    Return the Parquet file a TEI file is exported to
+
+    Args
+
+        tei_path (str): path to a TEI file
+        out_dir (str): root of the Parquet dataset
+
+    Returns
+
+        str
+    """
+    metadata = infer_metadata(tei_path)
+    return f"{out_dir}/year={int(metadata['year'])}/document_type={metadata['document_type']}/{metadata['filename']}.parquet"
+
+
+def export_file(tei_path, out_dir, batch_size=50000, overwrite=False):
+    """
+    Export one TEI file to its Parquet file. The file is written next to its destination and renamed
+    when done, so readers never see a half written file.
+
+    Args
+
+        tei_path (str): path to a TEI file
+        out_dir (str): root of the Parquet dataset
+        batch_size (int): rows per row group
+        overwrite (bool): export even if the Parquet file is newer than the TEI file
+
+    Returns
+
+        number of rows written, None if the file was up to date
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    dest = parquet_path(tei_path, out_dir)
+    if not overwrite and os.path.exists(dest) and os.path.getmtime(dest) >= os.path.getmtime(tei_path):
+        return None
+    metadata = infer_metadata(tei_path)
+    doc_fields = {
+        "document": metadata["filename"],
+        "chamber": metadata["chamber"],
+        "yearstr": metadata["yearstr"],
+        "secondary_year": metadata["secondary_year"],
+        "number": metadata["number"],
+    }
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    # dot files are ignored when the dataset is read
+    tmp = f"{os.path.dirname(dest)}/.{os.path.basename(dest)}.tmp"
+    n_rows = 0
+    batch = []
+    with pq.ParquetWriter(tmp, schema()) as writer:
+        for row in iter_tei_paragraphs(tei_path):
+            row.update(doc_fields)
+            batch.append(row)
+            if len(batch) >= batch_size:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema()))
+                n_rows += len(batch)
+                batch = []
+        if len(batch) > 0 or n_rows == 0:
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema()))
+            n_rows += len(batch)
+    os.replace(tmp, dest)
+    return n_rows
+
+
+def export_corpus(files, out_dir, batch_size=50000, overwrite=False, processes=None, chunksize=4, verbose=False):
+    """
+    Export TEI files to a partitioned Parquet dataset, in parallel.
+    Only files that changed since they were last exported are written, unless `overwrite` is set.
+
+    Args
+
+        files (list): TEI file paths, e.g. args.tei_files
+        out_dir (str): root of the Parquet dataset
+        batch_size (int): rows per row group
+        overwrite (bool): export all files
+        processes (int): number of worker processes (default: number of CPUs)
+        chunksize (int): files sent to a worker at a time
+        verbose (bool): print stuff
+
+    Returns
+
+        dict {"exported": n_files, "skipped": n_files, "rows": n_rows}
+    """
+    summary = {"exported": 0, "skipped": 0, "rows": 0}
+    func = functools.partial(export_file, out_dir=out_dir, batch_size=batch_size, overwrite=overwrite)
+    with Pool(processes=processes) as pool:
+        for n_rows in pool.imap_unordered(func, files, chunksize=chunksize):
+            if n_rows is None:
+                summary["skipped"] += 1
+            else:
+                summary["exported"] += 1
+                summary["rows"] += n_rows
+    if verbose: print(f"INFO: exported {summary['exported']} files ({summary['rows']} rows), {summary['skipped']} up to date")
+    return summary
+
+
+def open_dataset(out_dir):
+    """
+    Open an exported dataset. Files are memory mapped when read.
+
+    Args
+
+        out_dir (str): root of the Parquet dataset
+
+    Returns
+
+        pyarrow.dataset.Dataset
+    """
+    import pyarrow.dataset as ds
+    import pyarrow.fs
+    return ds.dataset(
+        out_dir,
+        format="parquet",
+        partitioning=partitioning(),
+        filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True),
+    )
+
+
+def read_paragraphs(out_dir, columns=None, filter=None):
+    """
+    Read (a selection of) an exported dataset as a pandas DataFrame
+
+    Args
+
+        out_dir (str): root of the Parquet dataset
+        columns (list): columns to read (default: all)
+        filter: pyarrow.dataset expression, e.g. `(ds.field("year") >= 1877) & (ds.field("tag") == "note")`
+
+    Returns
+
+        pandas DataFrame
+    """
+    return open_dataset(out_dir).to_table(columns=columns, filter=filter).to_pandas()
+
+
+
+
+if __name__ == '__main__':
+    from valtiopy.args import (
+        fetch_parser,
+        impute_arg_values,
+        reject_unsupported,
+    )
+    parser = fetch_parser(description=__doc__)
+    parser.add_argument("-o", "--out-dir",
+                        required = True,
+                        help = "Root of the Parquet dataset")
+    parser.add_argument("--batch-size",
+                        type = int,
+                        default = 50000,
+                        help = "Rows per row group")
+    parser.add_argument("--overwrite",
+                        action = 'store_true',
+                        help = "Re-export files that are up to date")
+    args = parser.parse_args()
+    reject_unsupported(parser, args, "resume")
+    args = impute_arg_values(args)
+    export_corpus(args.tei_files, args.out_dir, batch_size=args.batch_size, overwrite=args.overwrite,
+                  processes=args.jobs, chunksize=args.chunksize or 4, verbose=True)
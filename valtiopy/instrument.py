@@ -0,0 +1,259 @@
+"""
+Opt-in instrumentation of the conversion hot paths.
+
+Timers are no-ops until `enable()` is called. When enabled, wall time, call counts and bytes
+read/written are aggregated per document and stage, and the peak RSS of the process is recorded
+when a document is done. Results can be exported as JSON or CSV.
+
+The current document is tracked per thread. Stats collected in worker processes are sent back with
+`collect` and added to the parent's with `merge`.
+
+    from valtiopy import instrument
+    instrument.enable()
+    with instrument.document("prot_1877_adeln_II"):
+        ...
+    instrument.to_csv("stages.csv")
+"""
+from contextlib import nullcontext
+import csv
+import functools
+import json
+import threading
+import time
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+
+
+_ENABLED = False
+_STATS = {}
+_LOCAL = threading.local()
+_PEAK_RSS = {}
+_NULL = nullcontext()
+
+
+def enable():
+    """
+    Turn on instrumentation
+    """
+    global _ENABLED
+    _ENABLED = True
+
+
+def disable():
+    """
+    Turn off instrumentation. Collected stats are kept.
+    """
+    global _ENABLED
+    _ENABLED = False
+
+
+def is_enabled():
+    """
+    Return True if instrumentation is on
+    """
+    return _ENABLED
+
+
+def reset():
+    """
+    Forget all collected stats
+    """
+    _STATS.clear()
+    _PEAK_RSS.clear()
+
+
+def _document():
+    return getattr(_LOCAL, "document", None)
+
+
+def _stage(stage):
+    key = (_document(), stage)
+    if key not in _STATS:
+        _STATS[key] = {"seconds": 0.0, "calls": 0, "bytes_read": 0, "bytes_written": 0}
+    return _STATS[key]
+
+
+def _peak_rss():
+    if resource is None:
+        return None
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class _Timer:
+    __slots__ = ("stage", "t0")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        s = _stage(self.stage)
+        s["seconds"] += time.perf_counter() - self.t0
+        s["calls"] += 1
+        return False
+
+
+def timer(stage):
+    """
+    Context manager timing a stage of the current document.
+
+    Args
+
+        stage (str): stage name
+    """
+    if not _ENABLED:
+        return _NULL
+    return _Timer(stage)
+
+
+def timed(stage):
+    """
+    Decorator timing every call of a function as a stage.
+
+    Args
+
+        stage (str): stage name
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _ENABLED:
+                return func(*args, **kwargs)
+            with _Timer(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_bytes(stage, read=0, written=0):
+    """
+    Count bytes read or written by a stage of the current document.
+
+    Args
+
+        stage (str): stage name
+        read (int): bytes read
+        written (int): bytes written
+    """
+    if not _ENABLED:
+        return
+    s = _stage(stage)
+    s["bytes_read"] += read
+    s["bytes_written"] += written
+
+
+class document:
+    """
+    Context manager attributing stats collected inside it, in the same thread, to a document.
+
+    Args
+
+        name (str): document name, e.g. the filename
+    """
+    __slots__ = ("name", "previous")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.previous = _document()
+        _LOCAL.document = self.name
+        return self
+
+    def __exit__(self, *exc):
+        _LOCAL.document = self.previous
+        if _ENABLED:
+            _PEAK_RSS[self.name] = _peak_rss()
+        return False
+
+
+def collect(func, *args):
+    """
+    Call a function with instrumentation enabled and return its result together with the stats it collected.
+    Meant for worker processes: the stats are sent back with the result and added to the parent's with `merge`.
+
+    Args
+
+        func (callable): function to call
+        args: arguments of func
+
+    Returns
+
+        result of func, list of rows (see `stats`)
+    """
+    enable()
+    reset()
+    result = func(*args)
+    return result, stats()
+
+
+def merge(rows):
+    """
+    Add stats collected elsewhere, e.g. in a worker process, to the collected stats
+
+    Args
+
+        rows (list): output of `stats()`
+    """
+    for row in rows:
+        s = _STATS.setdefault((row["document"], row["stage"]), {"seconds": 0.0, "calls": 0, "bytes_read": 0, "bytes_written": 0})
+        for k in s:
+            s[k] += row[k]
+        if row["peak_rss_kb"] is not None:
+            _PEAK_RSS[row["document"]] = max(_PEAK_RSS.get(row["document"]) or 0, row["peak_rss_kb"])
+
+
+def stats():
+    """
+    Return the collected stats as a list of rows
+
+    "peak_rss_kb" is the highest RSS the process that processed the document had reached when the document
+    was done (`ru_maxrss`), i.e. an upper bound on the memory the document needed, not the memory of the document alone.
+    It is None for stats outside of a `document`.
+
+    Returns
+
+        list of dicts with the keys "document", "stage", "seconds", "calls", "bytes_read", "bytes_written" and "peak_rss_kb"
+    """
+    rows = []
+    for (doc, stage), s in _STATS.items():
+        row = {"document": doc, "stage": stage}
+        row.update(s)
+        row["peak_rss_kb"] = _PEAK_RSS.get(doc)
+        rows.append(row)
+    return rows
+
+
+def to_json(path):
+    """
+    Write the collected stats to a JSON file
+
+    Args
+
+        path (str): output path
+    """
+    with open(path, 'w+') as outf:
+        json.dump(stats(), outf, indent=2)
+
+
+def to_csv(path):
+    """
+    Write the collected stats to a CSV file
+
+    Args
+
+        path (str): output path
+    """
+    fields = ["document", "stage", "seconds", "calls", "bytes_read", "bytes_written", "peak_rss_kb"]
+    with open(path, 'w+', newline='') as outf:
+        writer = csv.DictWriter(outf, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(stats())
@@ -0,0 +1,366 @@
+"""
+Tag the primary language of documents: Finnish ("f"), Swedish ("s") or mixed ("fs").
+
+Paragraphs are classified with a character trigram model (naive Bayes over trigram log probabilities)
+built from the sample texts below, or from labeled texts with `train_model`. A document is Swedish or
+Finnish when at least `MIXED_THRESHOLD` of its classified characters are, and mixed otherwise.
+
+The labels are written to a per-document cache (`LANGUAGE_CACHE`, keyed by document id), which is what
+`--languages` filters on in `valtiopy.args.impute_arg_values`. Tagging streams each TEI file once, in
+`--jobs` worker processes, and skips files that haven't changed since they were tagged. The cache is
+saved every `SAVE_EVERY` documents, so an interrupted run can be continued with `--resume`.
+
+    python -m valtiopy.language -j 8 -v
+"""
+from collections import Counter
+from valtiopy.args import (
+    document_id,
+    LANGUAGE_CACHE,
+    run_over_files,
+)
+from valtiopy.build import fingerprint_file
+from valtiopy.utils import (
+    atomic_write,
+    iter_tei_paragraphs,
+)
+import functools
+import json
+import math
+import os
+import re
+
+
+
+
+MODEL_VERSION = "1"
+MIXED_THRESHOLD = 0.8
+MIN_CHARS = 20
+MAX_CHARS = 2000
+SAVE_EVERY = 100
+NON_LETTER = re.compile(r"[\W\d_]+")
+SAMPLES = {
+    "s": """
+        Herr talman! Då frågan om statsutskottets betänkande angående regeringens proposition i
+        anledning av landtdagens underdåniga skrifvelse nu åter förevarit till öfverläggning, anhåller
+        jag att få yttra några ord. Ståndet har redan vid föregående sammanträde beslutit att remittera
+        ärendet till utskottet, och utskottet har uti sitt betänkande föreslagit, att ståndet måtte
+        bifalla propositionen med de ändringar som utskottet funnit nödiga. Jag kan för min del icke
+        förena mig med denna mening, enär de skäl som anförts för förslaget icke synas mig vara
+        tillräckliga. Det är nämligen icke visadt, att de medel som härför erfordras kunna anskaffas
+        utan att skattebördan för landets allmoge ökas, och jag tror att ständerna böra taga i
+        betraktande huru svåra förhållandena äro för den jordbrukande befolkningen. Protokollet
+        justerades och sammanträdet afslutades. Upplästes och godkändes följande till ståndet inkomna
+        skrifvelser från de öfriga stånden, hvarefter talmannen förklarade att frågan skulle
+        föredragas vid nästa plenum. Ridderskapet och adeln, prästeståndet, borgareståndet och
+        bondeståndet hafva i sina svar till hans kejserliga majestät uttalat sin tacksamhet för
+        den nådiga omvårdnad som kommit landet till del. Grefve, friherre och ledamöter af ståndet
+        yttrade sig härom, och sedan öfverläggningen förklarats slutad, framställde talmannen
+        proposition på bifall till utskottets förslag, hvilken proposition med ja besvarades.
+        Skolväsendet, kommunikationerna, kyrkolagen, tullarne och banken äro frågor som länge
+        sysselsatt representationen. Enligt min tanke borde man icke skynda, utan noga pröfva
+        hvarje förslag innan beslut fattas. Sekreteraren uppläste ett memorial, som i sin helhet
+        lyder som följer: Undertecknad får vördsamt föreslå, att ständerna ville anhålla om att
+        lagen om näringarnas utöfvande måtte förändras så att landsbygdens invånare finge samma
+        rättigheter som städernas borgerskap.
+    """,
+    "f": """
+        Herra puhemies! Kun kysymys valtiovarainvaliokunnan mietinnöstä, joka koskee hallituksen
+        esitystä valtiopäivien alamaisen anomuksen johdosta, nyt uudestaan on ollut keskusteltavana,
+        pyydän saada lausua muutaman sanan. Sääty on jo edellisessä istunnossa päättänyt lähettää asian
+        valiokuntaan, ja valiokunta on mietinnössään ehdottanut, että sääty hyväksyisi esityksen niillä
+        muutoksilla, jotka valiokunta on katsonut tarpeellisiksi. Minä en puolestani voi yhtyä tähän
+        mielipiteeseen, koska ne syyt, joita ehdotuksen puolesta on esitetty, eivät minusta näytä
+        riittäviltä. Ei nimittäin ole näytetty, että ne varat, joita tähän tarvitaan, voidaan hankkia
+        lisäämättä maan talonpoikaisväestön verotaakkaa, ja luulen että säätyjen tulee ottaa huomioon,
+        kuinka vaikeat olot maata viljelevällä kansalla ovat. Pöytäkirja tarkastettiin ja istunto
+        lopetettiin. Luettiin ja hyväksyttiin seuraavat muilta säädyiltä saapuneet kirjelmät, jonka
+        jälkeen puhemies ilmoitti, että asia esitellään seuraavassa täysistunnossa. Ritaristo ja
+        aatelisto, pappissääty, porvarissääty ja talonpoikaissääty ovat vastauksissaan hänen
+        keisarilliselle majesteetilleen lausuneet kiitollisuutensa siitä armollisesta huolenpidosta,
+        jota maa on saanut osakseen. Kreivi, vapaaherra ja säädyn jäsenet lausuivat tästä
+        mielipiteensä, ja sittenkun keskustelu oli julistettu päättyneeksi, teki puhemies ehdotuksen
+        valiokunnan ehdotuksen hyväksymisestä, johon vastattiin myöntävästi. Kansakoululaitos,
+        kulkuneuvot, kirkkolaki, tullit ja pankki ovat kysymyksiä, jotka kauan ovat askarruttaneet
+        eduskuntaa. Minun mielestäni ei pitäisi kiirehtiä, vaan tarkoin harkita jokaista ehdotusta
+        ennenkuin päätös tehdään. Sihteeri luki kirjelmän, joka kokonaisuudessaan kuuluu näin:
+        Allekirjoittanut rohkenee kunnioittavasti ehdottaa, että säädyt anoisivat elinkeinojen
+        harjoittamisesta annetun lain muuttamista niin, että maaseudun asukkaat saisivat samat
+        oikeudet kuin kaupunkien porvaristo.
+    """,
+}
+
+
+def _normalize(text):
+    return f" {NON_LETTER.sub(' ', text.lower()).strip()} "
+
+
+def trigrams(text):
+    """
+    Count the character trigrams of a text. Text is lower cased and runs of non-letters are replaced by a space.
+
+    Args
+
+        text (str): the text
+
+    Returns
+
+        collections.Counter
+    """
+    text = _normalize(text)
+    return Counter(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def train_model(texts):
+    """
+    Build a trigram model from labeled texts
+
+    Args
+
+        texts (dict): {language: iterable of texts}, e.g. {"f": [...], "s": [...]}
+
+    Returns
+
+        model (dict) {"version": ..., "logp": {language: {trigram: log probability}}, "unseen": {language: log probability}}
+    """
+    counts = {}
+    for language, language_texts in texts.items():
+        counts[language] = Counter()
+        for text in language_texts:
+            counts[language].update(trigrams(text))
+    vocabulary = set().union(*counts.values())
+    model = {"version": MODEL_VERSION, "logp": {}, "unseen": {}}
+    for language, c in counts.items():
+        # add-one smoothing over the joint vocabulary
+        denominator = math.log(sum(c.values()) + len(vocabulary) + 1)
+        model["logp"][language] = {t: math.log(n + 1) - denominator for t, n in c.items()}
+        model["unseen"][language] = -denominator
+    return model
+
+
+@functools.lru_cache(maxsize=None)
+def default_model():
+    """
+    Return the model built from `SAMPLES` (built once per process)
+    """
+    return train_model({language: [text] for language, text in SAMPLES.items()})
+
+
+@functools.lru_cache(maxsize=None)
+def load_model(path):
+    """
+    Load a model saved with `save_model` (cached per process)
+
+    Args
+
+        path (str): JSON file
+    """
+    with open(path, 'r') as inf:
+        return json.load(inf)
+
+
+def save_model(model, path):
+    """
+    Save a model to a JSON file
+
+    Args
+
+        model (dict): output of `train_model`
+        path (str): JSON file
+    """
+    with open(path, 'w+') as outf:
+        json.dump(model, outf)
+
+
+def classify(text, model=None):
+    """
+    Classify a text as Finnish or Swedish
+
+    Args
+
+        text (str): the text. Only the first `MAX_CHARS` characters are used.
+        model (dict): output of `train_model` (default: `default_model()`)
+
+    Returns
+
+        language (str) with the highest likelihood, None if the text is shorter than `MIN_CHARS` letters
+    """
+    if model is None:
+        model = default_model()
+    counts = trigrams(text[:MAX_CHARS])
+    if sum(counts.values()) < MIN_CHARS:
+        return None
+    best, best_score = None, -math.inf
+    for language, logp in model["logp"].items():
+        unseen = model["unseen"][language]
+        score = sum(n * logp.get(t, unseen) for t, n in counts.items())
+        if score > best_score:
+            best, best_score = language, score
+    return best
+
+
+def document_language(chars):
+    """
+    Label a document (or page) from the number of characters classified per language
+
+    Args
+
+        chars (dict): {"f": n, "s": n}
+
+    Returns
+
+        "f", "s", "fs", or None if nothing was classified
+    """
+    total = sum(chars.values())
+    if total == 0:
+        return None
+    for language in ["f", "s"]:
+        if chars.get(language, 0) / total >= MIXED_THRESHOLD:
+            return language
+    return "fs"
+
+
+def tag_file(path, level="document", model_path=None):
+    """
+    Tag the language of a TEI file in one streaming pass
+
+    Args
+
+        path (str): TEI file
+        level (str): "document", or "page" to also label each page
+        model_path (str): model saved with `save_model` (default: the built-in model)
+
+    Returns
+
+        dict with the keys "language", "chars" ({language: n}), "fingerprint" and, at page level, "pages" ({page: language})
+    """
+    model = default_model() if model_path is None else load_model(model_path)
+    chars = {"f": 0, "s": 0}
+    page_chars = {}
+    for row in iter_tei_paragraphs(path):
+        if row["text"] is None:
+            continue
+        language = classify(row["text"], model)
+        if language is None:
+            continue
+        chars[language] += len(row["text"])
+        if level == "page":
+            page_chars.setdefault(row["page"], {"f": 0, "s": 0})[language] += len(row["text"])
+    result = {"language": document_language(chars), "chars": chars, "fingerprint": fingerprint_file(path)}
+    if level == "page":
+        result["pages"] = {page: document_language(c) for page, c in page_chars.items()}
+    return result
+
+
+def load_language_cache(cache_path=LANGUAGE_CACHE):
+    """
+    Load the language cache. Returns an empty cache if there is none.
+
+    Args
+
+        cache_path (str): path to the cache
+
+    Returns
+
+        dict {"version": ..., "documents": {document id: tag_file output}}
+    """
+    try:
+        with open(cache_path, 'r') as inf:
+            return json.load(inf)
+    except FileNotFoundError:
+        return {"version": MODEL_VERSION, "documents": {}}
+
+
+def save_language_cache(cache, documents, cache_path=LANGUAGE_CACHE):
+    """
+    Add tagged documents to the language cache on disk and write it atomically
+
+    Args
+
+        cache (dict): cache the documents were tagged for, see `load_language_cache`
+        documents (dict): {document id: tag_file output}
+        cache_path (str): path to the cache
+    """
+    # re-read, other shards may have saved their documents since
+    saved = load_language_cache(cache_path)
+    if saved.get("version") != cache["version"] or saved.get("model") != cache.get("model"):
+        saved = {"version": cache["version"], "model": cache.get("model"), "documents": {}}
+    saved["documents"].update(documents)
+    atomic_write(cache_path, json.dumps(saved, indent=2, sort_keys=True).encode("utf-8"))
+
+
+def tag_corpus(args, cache_path=LANGUAGE_CACHE, level="document", model_path=None, force=False):
+    """
+    Tag the selected TEI files with `run_over_files` (honors --jobs, --chunksize, --shard and --resume)
+    and update the language cache as documents are done. Files that haven't changed since they were tagged with the same model are skipped.
+
+    Args
+
+        args: Argparse args processed by `valtiopy.args.impute_arg_values`
+        cache_path (str): language cache
+        level (str): "document" or "page"
+        model_path (str): model saved with `save_model` (default: the built-in model)
+        force (bool): tag all files
+
+    Returns
+
+        summary (dict): number of documents per language, and of skipped documents
+    """
+    cache = load_language_cache(cache_path)
+    if cache.get("version") != MODEL_VERSION or cache.get("model") != model_path:
+        cache = {"version": MODEL_VERSION, "model": model_path, "documents": {}}
+    documents = cache["documents"]
+    files = []
+    for path in args.tei_files:
+        entry = documents.get(document_id(path))
+        if force or entry is None or entry["fingerprint"] != fingerprint_file(path) or (level == "page" and "pages" not in entry):
+            files.append(path)
+    if args.verbose: print(f"INFO: tagging {len(files)} files, {len(args.tei_files) - len(files)} up to date")
+
+    func = functools.partial(tag_file, level=level, model_path=model_path)
+    summary = {"f": 0, "s": 0, "fs": 0, None: 0, "skipped": len(args.tei_files) - len(files)}
+    pending = {}
+
+    def on_result(path, result):
+        # --resume journals the files returned, i.e. the ones in the saved cache
+        pending[path] = result
+        summary[result["language"]] += 1
+        if len(pending) < SAVE_EVERY:
+            return []
+        saved = list(pending)
+        save_language_cache(cache, {document_id(f): r for f, r in pending.items()}, cache_path)
+        pending.clear()
+        return saved
+
+    try:
+        run_over_files(func, args, files=files, ordered=False, on_result=on_result)
+    finally:
+        if len(pending) > 0 or not os.path.exists(cache_path):
+            save_language_cache(cache, {document_id(f): r for f, r in pending.items()}, cache_path)
+    summary["untagged"] = summary.pop(None)
+    if args.verbose: print(f"INFO: {summary}")
+    return summary
+
+
+
+
+if __name__ == '__main__':
+    from valtiopy.args import (
+        fetch_parser,
+        impute_arg_values,
+    )
+    parser = fetch_parser(description=__doc__)
+    parser.add_argument("--level",
+                        choices = ["document", "page"],
+                        default = "document",
+                        help = "Also store the language of each page")
+    parser.add_argument("--model",
+                        default = None,
+                        help = "Trigram model saved with save_model (default: the built-in model)")
+    parser.add_argument("--force",
+                        action = 'store_true',
+                        help = "Tag documents that are tagged already")
+    args = parser.parse_args()
+    # tag everything, not only the documents already tagged with the selected languages
+    args.languages = None
+    args = impute_arg_values(args)
+    print(json.dumps(tag_corpus(args, cache_path=args.language_cache, level=args.level, model_path=args.model, force=args.force), indent=2))
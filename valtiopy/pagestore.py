@@ -0,0 +1,218 @@
+"""
+A compact, memory mapped store of page texts for fast random access.
+
+A store is a directory holding
+- `texts.bin`: the UTF-8 text of all pages, concatenated
+- `offsets.npy`: int64 array, page i is `texts.bin[offsets[i]:offsets[i+1]]`
+- `index.json`: {document: {page_nr: i}}
+
+Paragraphs of a page are separated by `PARAGRAPH_SEP`. The text blob is opened with `mmap`,
+so lookups are slices of the page cache shared by all processes reading the store.
+
+    store = PageStore("stores/records")
+    store.page("prot_1877_adeln_II", "012")
+"""
+from valtiopy.build import group_alto_files
+from valtiopy.curate import alto_to_document
+from valtiopy.document import Document
+import json
+import mmap
+import numpy as np
+import os
+
+
+
+
+PARAGRAPH_SEP = "\n\n"
+
+
+class PageStoreWriter:
+    """
+    Append documents to a page store. Use as a context manager or call `close()` when done.
+
+    Documents that are added again replace the old ones in the index. Their old text stays in
+    the blob until the store is rebuilt from scratch.
+
+    Args
+
+        store_dir (str): store directory, created if it doesn't exist
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        if os.path.exists(f"{store_dir}/offsets.npy"):
+            self.offsets = np.load(f"{store_dir}/offsets.npy").tolist()
+            with open(f"{store_dir}/index.json", 'r') as inf:
+                self.index = json.load(inf)
+        else:
+            self.offsets = [0]
+            self.index = {}
+        self._blob = open(f"{store_dir}/texts.bin", 'ab')
+        # drop text from an interrupted write that isn't in the offsets
+        self._blob.truncate(self.offsets[-1])
+
+    def add_document(self, document, pages=None):
+        """
+        Add a document
+
+        Args
+
+            document (str or Document): document name, e.g. "prot_1877_adeln_II", or a `valtiopy.document.Document`
+            pages (dict): {page_nr: [paragraph, paragraph...]}, as returned by `convert_alto`. Not used with a Document.
+        """
+        if isinstance(document, Document):
+            document, pages = document.filename, document
+        doc_index = {}
+        for nr, paragraphs in pages.items():
+            b = PARAGRAPH_SEP.join(paragraphs).encode("utf-8")
+            self._blob.write(b)
+            doc_index[nr] = len(self.offsets) - 1
+            self.offsets.append(self.offsets[-1] + len(b))
+        self.index[document] = doc_index
+
+    def close(self):
+        """
+        Flush the text and write the offsets and index
+        """
+        self._blob.close()
+        np.save(f"{self.store_dir}/offsets.npy", np.array(self.offsets, dtype=np.int64))
+        with open(f"{self.store_dir}/index.json", 'w+') as outf:
+            json.dump(self.index, outf)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class PageStore:
+    """
+    Read only access to a page store.
+
+    Args
+
+        store_dir (str): store directory written with `PageStoreWriter`
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.offsets = np.load(f"{store_dir}/offsets.npy", mmap_mode='r')
+        with open(f"{store_dir}/index.json", 'r') as inf:
+            self.index = json.load(inf)
+        self._file = open(f"{store_dir}/texts.bin", 'rb')
+        if self.offsets[-1] > 0:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # an empty file can't be mapped
+            self._mm = b""
+        self._view = memoryview(self._mm)
+
+    def documents(self):
+        """
+        Return the names of the documents in the store
+        """
+        return list(self.index)
+
+    def pages(self, document):
+        """
+        Return the page numbers of a document
+        """
+        return list(self.index[document])
+
+    def page_bytes(self, document, page):
+        """
+        Return the UTF-8 text of a page as a zero-copy memoryview of the mapped blob
+
+        Args
+
+            document (str): document name
+            page (str): page number
+        """
+        i = self.index[document][page]
+        return self._view[self.offsets[i]:self.offsets[i + 1]]
+
+    def page(self, document, page):
+        """
+        Return the text of a page, paragraphs separated by `PARAGRAPH_SEP`
+
+        Args
+
+            document (str): document name
+            page (str): page number
+        """
+        return str(self.page_bytes(document, page), "utf-8")
+
+    def paragraphs(self, document, page):
+        """
+        Return the paragraphs of a page as a list
+
+        Args
+
+            document (str): document name
+            page (str): page number
+        """
+        text = self.page(document, page)
+        if text == "":
+            return []
+        return text.split(PARAGRAPH_SEP)
+
+    def __contains__(self, document):
+        return document in self.index
+
+    def close(self):
+        """
+        Unmap the blob
+        """
+        self._view.release()
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def build_page_store(alto_files, store_dir, verbose=False):
+    """
+    Convert ALTO files document by document and add them to a page store.
+
+    Args
+
+        alto_files (list): ALTO page files, e.g. args.alto_files
+        store_dir (str): store directory
+        verbose (bool): print stuff
+    """
+    with PageStoreWriter(store_dir) as writer:
+        for doc_dir, files in group_alto_files(alto_files).items():
+            if verbose: print(f"INFO: adding {doc_dir}")
+            writer.add_document(alto_to_document(files, os.path.basename(doc_dir)))
+
+
+
+
+if __name__ == '__main__':
+    from valtiopy.args import (
+        fetch_parser,
+        impute_arg_values,
+        reject_unsupported,
+    )
+    parser = fetch_parser(description=__doc__)
+    parser.add_argument("-o", "--store-dir",
+                        required = True,
+                        help = "Directory for the page stores, one per collection")
+    args = parser.parse_args()
+    reject_unsupported(parser, args, "jobs", "chunksize", "resume")
+    args.docformats = ["alto"]
+    args = impute_arg_values(args)
+    for k, location in vars(args.config).items():
+        if "ALTO" not in k or location is None:
+            continue
+        location = os.path.abspath(location)
+        files = [f for f in args.alto_files if os.path.abspath(f).startswith(location + os.sep)]
+        if len(files) > 0:
+            build_page_store(files, f"{args.store_dir}/{os.path.basename(location)}", verbose=args.verbose)
@@ -0,0 +1,197 @@
+"""
+A pipelined executor for reading, converting and writing corpus files.
+
+Work is split in three stages -- read-ahead, compute and write-behind -- connected by bounded queues.
+Reads and writes run in thread pools so disk (or network storage) latency overlaps with the CPU-bound
+compute stage, which runs in a process pool by default. Full queues block the stage in front of them,
+so at most `queue_size` items are held in memory between two stages.
+
+With `valtiopy.instrument` enabled, the stats collected in compute worker processes are added to the
+calling process's stats.
+"""
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from lxml import etree
+from valtiopy import instrument
+from valtiopy.curate import (
+    alto_to_document,
+    dict_to_tei,
+)
+from valtiopy.utils import (
+    atomic_write,
+    tei_to_bytes,
+)
+import asyncio
+import functools
+import os
+import time
+
+
+
+
+_DONE = object()
+
+
+async def _source(items, outq, n_consumers):
+    for ix, item in enumerate(items):
+        await outq.put((ix, item))
+    for _ in range(n_consumers):
+        await outq.put(_DONE)
+
+
+async def _worker(func, executor, inq, outq, merge_stats=False):
+    loop = asyncio.get_running_loop()
+    while True:
+        task = await inq.get()
+        if task is _DONE:
+            return
+        ix, item = task
+        result = await loop.run_in_executor(executor, func, item)
+        if merge_stats:
+            result, stats = result
+            instrument.merge(stats)
+        await outq.put((ix, result))
+
+
+async def _stage(func, executor, n_workers, inq, outq, n_consumers, merge_stats=False):
+    await asyncio.gather(*[_worker(func, executor, inq, outq, merge_stats=merge_stats) for _ in range(n_workers)])
+    for _ in range(n_consumers):
+        await outq.put(_DONE)
+
+
+async def _collect(inq, results, on_result=None, verbose=False):
+    t0 = time.perf_counter()
+    while True:
+        task = await inq.get()
+        if task is _DONE:
+            return
+        results.append(task)
+        if on_result is not None:
+            on_result(task[1])
+        if verbose and len(results) % 100 == 0:
+            print(f"INFO: {len(results)} items done ({len(results) / (time.perf_counter() - t0):.1f}/s)")
+
+
+async def _run(items, read, compute, write, read_workers, compute_workers, write_workers, queue_size, compute_executor, on_result, verbose):
+    if compute_workers is None:
+        compute_workers = os.cpu_count() or 1
+    read_pool = ThreadPoolExecutor(max_workers=read_workers)
+    write_pool = ThreadPoolExecutor(max_workers=write_workers)
+    if compute_executor == "process":
+        compute_pool = ProcessPoolExecutor(max_workers=compute_workers)
+    elif compute_executor == "thread":
+        compute_pool = ThreadPoolExecutor(max_workers=compute_workers)
+    else:
+        raise ValueError(f"Unknown compute executor: {compute_executor}")
+    # stats collected in other processes are sent back with the results
+    merge_stats = compute_executor == "process" and instrument.is_enabled()
+    if merge_stats:
+        compute = functools.partial(instrument.collect, compute)
+
+    read_q = asyncio.Queue(maxsize=queue_size)
+    compute_q = asyncio.Queue(maxsize=queue_size)
+    write_q = asyncio.Queue(maxsize=queue_size)
+    done_q = asyncio.Queue()
+    results = []
+    tasks = [
+        asyncio.ensure_future(_source(items, read_q, read_workers)),
+        asyncio.ensure_future(_stage(read, read_pool, read_workers, read_q, compute_q, compute_workers)),
+        asyncio.ensure_future(_stage(compute, compute_pool, compute_workers, compute_q, write_q, write_workers, merge_stats=merge_stats)),
+        asyncio.ensure_future(_stage(write, write_pool, write_workers, write_q, done_q, 1)),
+        asyncio.ensure_future(_collect(done_q, results, on_result=on_result, verbose=verbose)),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        read_pool.shutdown(wait=True)
+        compute_pool.shutdown(wait=True)
+        write_pool.shutdown(wait=True)
+    return results
+
+
+def run_pipeline(items, read, compute, write,
+                 read_workers=4, compute_workers=None, write_workers=2,
+                 queue_size=8, compute_executor="process", ordered=True, on_result=None, verbose=False):
+    """
+    Run items through a read -> compute -> write pipeline.
+
+    Args
+
+        items (iterable): inputs to the read stage
+        read (callable): item -> data, I/O bound, run in threads
+        compute (callable): data -> data, CPU bound. Must be picklable (module level) with the process executor
+        write (callable): data -> result, I/O bound, run in threads
+        read_workers (int): concurrent reads
+        compute_workers (int): concurrent compute workers (default: number of CPUs)
+        write_workers (int): concurrent writes
+        queue_size (int): max items waiting between two stages (back-pressure)
+        compute_executor (str): "process" or "thread"
+        ordered (bool): return results in the order of the items
+        on_result (callable): write stage result -> None, called in the calling process as each item is done
+        verbose (bool): print progress
+
+    Returns
+
+        list of write stage results
+    """
+    results = asyncio.run(_run(items, read, compute, write,
+                               read_workers, compute_workers, write_workers,
+                               queue_size, compute_executor, on_result, verbose))
+    if ordered:
+        results = sorted(results, key=lambda x: x[0])
+    return [r for ix, r in results]
+
+
+def _document_name(tei_path):
+    return os.path.basename(tei_path).split(".")[0]
+
+
+def _read_document(document):
+    data, tei_path = document
+    with instrument.document(_document_name(tei_path)):
+        return alto_to_document(data["alto_files"], data["filename"]), tei_path
+
+
+def _compute_document(read_result, padding=8, roundtrip=True):
+    data, tei_path = read_result
+    with instrument.document(_document_name(tei_path)):
+        b = tei_to_bytes(dict_to_tei(data), padding=padding)
+        if roundtrip:
+            # same write-read-write test as dict_to_parlaclarin, without touching the disk
+            parser = etree.XMLParser(remove_blank_text=True)
+            b = tei_to_bytes(etree.fromstring(b, parser), padding=padding)
+    return b, tei_path
+
+
+def _write_document(compute_result):
+    b, tei_path = compute_result
+    with instrument.document(_document_name(tei_path)):
+        os.makedirs(os.path.dirname(tei_path), exist_ok=True)
+        with instrument.timer("write_tei"):
+            atomic_write(tei_path, b)
+        instrument.add_bytes("write_tei", written=len(b))
+    return tei_path
+
+
+def convert_documents(documents, padding=8, roundtrip=True, **kwargs):
+    """
+    Convert ALTO documents to TEI with the pipelined executor.
+    Produces the same files as `convert_alto` + `dict_to_parlaclarin` in a serial loop.
+
+    Args
+
+        documents (iterable): (data, tei_path) tuples, where data is a metadata dict (`infer_metadata`) with an extra key "alto_files" listing the document's ALTO pages
+        padding (int): passed to `tei_to_bytes`
+        roundtrip (bool): reparse and reformat the output before writing
+        **kwargs: passed to `run_pipeline`
+
+    Returns
+
+        list of written TEI paths
+    """
+    compute = functools.partial(_compute_document, padding=padding, roundtrip=roundtrip)
+    return run_pipeline(documents, _read_document, compute, _write_document, **kwargs)
@@ -0,0 +1,166 @@
+"""
+Reformat existing TEI files in place, in bulk.
+
+Each file is parsed and written again with `tei_to_bytes`. A manifest records, per file, the
+formatter version, padding and content hash after formatting, so files that were already formatted
+with the current formatter and haven't changed since are skipped without being parsed. Files whose
+formatted content is identical to what is on disk are not rewritten, and rewrites are atomic.
+The manifest is saved every `SAVE_EVERY` files, so an interrupted run can be continued with `--resume`,
+and is merged with the manifest on disk when saved, so shards (`--shard`) can run at the same time.
+
+    python -m valtiopy.reformat -j 8 -v
+"""
+from lxml import etree
+from valtiopy.args import run_over_files
+from valtiopy.utils import (
+    atomic_write,
+    FORMATTER_VERSION,
+    tei_to_bytes,
+)
+import functools
+import hashlib
+import json
+import os
+import time
+
+
+
+
+REFORMAT_MANIFEST = ".valtiopy-format.json"
+SAVE_EVERY = 100
+
+
+@functools.lru_cache(maxsize=None)
+def _read_manifest(manifest_path):
+    # read once per worker process
+    return load_manifest(manifest_path)
+
+
+def load_manifest(manifest_path):
+    """
+    Load a reformat manifest. Returns an empty manifest if there is none.
+
+    Args
+
+        manifest_path (str): path to the manifest
+
+    Returns
+
+        dict {absolute TEI path: {"version": ..., "padding": ..., "sha256": ...}}
+    """
+    try:
+        with open(manifest_path, 'r') as inf:
+            return json.load(inf)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(records, manifest_path):
+    """
+    Add records to the manifest on disk and write it atomically
+
+    Args
+
+        records (dict): {absolute TEI path: record}, see `load_manifest`
+        manifest_path (str): path to the manifest
+    """
+    # re-read, other shards may have saved their records since
+    manifest = load_manifest(manifest_path)
+    manifest.update(records)
+    atomic_write(manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+
+
+def reformat_file(path, padding=8, manifest_path=REFORMAT_MANIFEST):
+    """
+    Reformat one TEI file in place
+
+    Args
+
+        path (str): path to a TEI file
+        padding (int): passed to `tei_to_bytes`
+        manifest_path (str): manifest used to skip files that are formatted already
+
+    Returns
+
+        dict with the keys "status" ("skipped", "unchanged" or "rewritten"), "bytes" (size read) and "sha256" (of the formatted file)
+    """
+    with open(path, 'rb') as inf:
+        b = inf.read()
+    sha = hashlib.sha256(b).hexdigest()
+    record = _read_manifest(manifest_path).get(os.path.abspath(path))
+    if record == {"version": FORMATTER_VERSION, "padding": padding, "sha256": sha}:
+        return {"status": "skipped", "bytes": len(b), "sha256": sha}
+
+    parser = etree.XMLParser(remove_blank_text=True)
+    formatted = tei_to_bytes(etree.fromstring(b, parser), padding=padding)
+    if formatted == b:
+        return {"status": "unchanged", "bytes": len(b), "sha256": sha}
+    atomic_write(path, formatted)
+    return {"status": "rewritten", "bytes": len(b), "sha256": hashlib.sha256(formatted).hexdigest()}
+
+
+def reformat_corpus(args, padding=8, manifest_path=REFORMAT_MANIFEST):
+    """
+    Reformat the selected TEI files with `run_over_files` (honors --jobs, --chunksize, --shard and --resume)
+    and update the manifest as files are done.
+
+    Args
+
+        args: Argparse args processed by `valtiopy.args.impute_arg_values`
+        padding (int): passed to `tei_to_bytes`
+        manifest_path (str): reformat manifest
+
+    Returns
+
+        summary (dict): files per status, MB read and throughput in MB/s
+    """
+    _read_manifest.cache_clear()
+    t0 = time.perf_counter()
+    func = functools.partial(reformat_file, padding=padding, manifest_path=manifest_path)
+    pending = {}
+
+    def on_result(path, result):
+        # --resume journals the files returned, i.e. the ones in the saved manifest
+        pending[path] = {"version": FORMATTER_VERSION, "padding": padding, "sha256": result["sha256"]}
+        if len(pending) < SAVE_EVERY:
+            return []
+        saved = list(pending)
+        save_manifest({os.path.abspath(f): r for f, r in pending.items()}, manifest_path)
+        pending.clear()
+        return saved
+
+    try:
+        results = run_over_files(func, args, files=args.tei_files, ordered=False, on_result=on_result)
+    finally:
+        if len(pending) > 0:
+            save_manifest({os.path.abspath(f): r for f, r in pending.items()}, manifest_path)
+    elapsed = time.perf_counter() - t0
+
+    summary = {"skipped": 0, "unchanged": 0, "rewritten": 0}
+    n_bytes = 0
+    for path, result in results:
+        summary[result["status"]] += 1
+        n_bytes += result["bytes"]
+    summary["MB"] = n_bytes / 2**20
+    summary["MB/s"] = summary["MB"] / elapsed if elapsed > 0 else 0
+    if args.verbose: print(f"INFO: {len(results)} files, {summary['MB']:.1f} MB in {elapsed:.1f}s ({summary['MB/s']:.1f} MB/s)")
+    return summary
+
+
+
+
+if __name__ == '__main__':
+    from valtiopy.args import (
+        fetch_parser,
+        impute_arg_values,
+    )
+    parser = fetch_parser(description=__doc__)
+    parser.add_argument("--padding",
+                        type = int,
+                        default = 8,
+                        help = "Indentation passed to the formatter")
+    parser.add_argument("--manifest",
+                        default = REFORMAT_MANIFEST,
+                        help = "Reformat manifest recording formatter version and hashes")
+    args = impute_arg_values(parser.parse_args())
+    print(json.dumps(reformat_corpus(args, padding=args.padding, manifest_path=args.manifest), indent=2))
@@ -1,3 +1,5 @@
+from multiprocessing import Pool
+import functools
 import hashlib
 import numpy as np
 import os
@@ -6,6 +8,22 @@ import pandas as pd
 
 
 
+@functools.lru_cache(maxsize=256)
+def seed_to_int(seed):
+    """
+    Turn a string seed into a 32 bit random state
+
+    Args
+
+        seed (str): a random state
+
+    Return
+
+        int
+    """
+    return int(hashlib.sha256(seed.encode("utf-8")).hexdigest(), 16) % (2**32)
+
+
 def goldstandard(df, n=3, by=["year", "estate"], seed=None, scope="dir", sampled_format="pdf"):
     """
     Draw a goldstandard sample of N documents per stratum
@@ -40,7 +58,7 @@ def goldstandard(df, n=3, by=["year", "estate"], seed=None, scope="dir", sampled
         return sample_
 
     if seed is not None:
-        seed = int(hashlib.sha256(seed.encode("utf-8")).hexdigest(), 16) % (2**32)
+        seed = seed_to_int(seed)
     if scope == 'file':
         sample_ = df.groupby(by, group_keys=False).apply(lambda x: x.sample(n, random_state=seed), include_groups=False)
         sample_ = list(sample_["path"])
@@ -55,6 +73,172 @@ def goldstandard(df, n=3, by=["year", "estate"], seed=None, scope="dir", sampled
 
 
 
+class StratifiedSampler:
+    """
+    Streaming stratified sample of up to N rows per stratum, in bounded memory.
+
+    Every row gets a priority from a seeded hash of its `path`, and each stratum keeps the N rows
+    with the lowest priorities (bottom-k sampling). A row's priority doesn't depend on the other
+    rows, so the sample is the same however the rows are chunked, and samplers that saw different
+    parts of the data can be merged into the sample of all of it. Strata with fewer than N rows are
+    sampled whole.
+
+    Args
+
+        - n (int): number of rows to draw per stratum
+        - by (list): list of strata to stratify with
+        - seed (str): a random state
+    """
+    def __init__(self, n=3, by=["year", "estate"], seed=None):
+        self.n = n
+        self.by = list(by)
+        self.seed = seed
+        rng = np.random.default_rng(seed_to_int(seed) if seed is not None else 0)
+        self._hash_key = f"{rng.integers(2**63):016x}"[-16:]
+        self.reservoir = None
+
+    def _reduce(self, df):
+        # 64 bit hashes, ties are the same path
+        df = df.sort_values("_priority", kind="stable")
+        return df.groupby(self.by, sort=False, observed=True).head(self.n)
+
+    def update(self, chunk):
+        """
+        Add a chunk of rows
+
+        Args
+
+            - chunk (pandas DataFrame): rows with a column `path` and a column for each of the strata
+        """
+        chunk = chunk[["path"] + self.by].copy()
+        chunk["_priority"] = pd.util.hash_array(chunk["path"].astype(str).to_numpy(dtype=object), hash_key=self._hash_key)
+        if self.reservoir is not None:
+            chunk = pd.concat([self.reservoir, chunk], ignore_index=True)
+        self.reservoir = self._reduce(chunk)
+        return self
+
+    def merge(self, other):
+        """
+        Merge the sample of another sampler with the same n, strata and seed
+
+        Args
+
+            - other (StratifiedSampler)
+        """
+        if (other.n, other.by, other.seed) != (self.n, self.by, self.seed):
+            raise ValueError("Only samplers with the same n, strata and seed can be merged")
+        if other.reservoir is not None:
+            self.update(other.reservoir)
+        return self
+
+    def sample(self):
+        """
+        Return the sample, ordered by stratum and priority
+
+        Return
+
+            - pandas DataFrame with the column `path` and the strata columns
+        """
+        if self.reservoir is None:
+            return pd.DataFrame(columns=["path"] + self.by)
+        df = self.reservoir.sort_values(self.by + ["_priority"], kind="stable")
+        return df.drop(columns="_priority").reset_index(drop=True)
+
+
+def iter_chunks(source, chunksize=1_000_000, columns=None):
+    """
+    Read a table in chunks
+
+    Args
+
+        - source: a path to a CSV or Parquet file, a pandas DataFrame, or an iterable of DataFrames
+        - chunksize (int): rows per chunk
+        - columns (list): columns to read from files (default: all)
+
+    Yields
+
+        - pandas DataFrames
+    """
+    if isinstance(source, pd.DataFrame):
+        for i in range(0, len(source), chunksize):
+            yield source.iloc[i:i + chunksize]
+    elif isinstance(source, str) and source.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    elif isinstance(source, str):
+        yield from pd.read_csv(source, chunksize=chunksize, usecols=columns, dtype=str)
+    else:
+        yield from source
+
+
+def _sample_source(source, n, by, seed, chunksize):
+    sampler = StratifiedSampler(n=n, by=by, seed=seed)
+    for chunk in iter_chunks(source, chunksize=chunksize, columns=["path"] + list(by)):
+        sampler.update(chunk)
+    return sampler
+
+
+def stratified_sample(sources, n=3, by=["year", "estate"], seed=None, chunksize=1_000_000, processes=1):
+    """
+    Draw a stratified sample of N rows per stratum from one or more large tables, e.g. shards of a
+    per-page inventory, without loading them whole. Shards are sampled in parallel and merged. The
+    result depends only on the rows and the seed, not on the chunk size, the sharding or the number of workers.
+
+    Args
+
+        - sources: a source or a list of sources (see `iter_chunks`). Only paths and DataFrames can be sent to worker processes.
+        - n (int): number of rows to draw per stratum
+        - by (list): list of strata to stratify with
+        - seed (str): a random state
+        - chunksize (int): rows read at a time
+        - processes (int): number of worker processes
+
+    Return
+
+        - pandas DataFrame with the column `path` and the strata columns
+    """
+    if isinstance(sources, (str, pd.DataFrame)):
+        sources = [sources]
+    func = functools.partial(_sample_source, n=n, by=by, seed=seed, chunksize=chunksize)
+    if processes > 1:
+        with Pool(processes=processes) as pool:
+            samplers = pool.map(func, sources)
+    else:
+        samplers = map(func, sources)
+    sampler = StratifiedSampler(n=n, by=by, seed=seed)
+    for s in samplers:
+        sampler.merge(s)
+    return sampler.sample()
+
+
+def goldstandard_stream(sources, n=3, by=["year", "estate"], seed=None, sampled_format="pdf", chunksize=1_000_000, processes=1):
+    """
+    Draw a goldstandard sample of N files per stratum, like `goldstandard` with `scope="file"`,
+    from tables too large to fit in memory (see `stratified_sample`). The sample differs from the one
+    drawn by `goldstandard` with the same seed.
+
+    Args
+
+        - sources: a source or a list of sources (see `iter_chunks`) with a column `path` and a column for each of the strata
+        - n (int): number of items to draw
+        - by (list): list of strata to stratify with
+        - seed (str): a random state
+        - sampled_format (str): "pdf" corrects the alto paths of the sample to the PDF (see `goldstandard`)
+        - chunksize (int): rows read at a time
+        - processes (int): number of worker processes
+
+    Return
+
+        - list
+    """
+    sample_ = stratified_sample(sources, n=n, by=by, seed=seed, chunksize=chunksize, processes=processes)["path"].to_list()
+    if sampled_format == "pdf":
+        sample_ = [_.replace("-alto", "-pdf").replace(".xml", ".pdf") for _ in sample_]
+    return sample_
+
+
+
 if __name__ == '__main__':
     rows1 = [
         ["file1", "1992", "a"],
@@ -0,0 +1,189 @@
+"""
+Generate deterministic synthetic Valtiopaivat Corpus data: ALTO pages, TEI documents,
+persons metadata tables and directory trees mirroring the `data/<year>/<doctype>_<year>_<chamber>_<num>` layout.
+
+The same seed always gives the same data, so the output can be used for benchmarks and testing.
+"""
+from valtiopy.config import ValtiopaivatCorpusConfig
+from valtiopy.curate import dict_to_parlaclarin
+from valtiopy.utils import infer_metadata
+from xml.sax.saxutils import quoteattr
+import os
+import pandas as pd
+import random
+
+
+
+
+WORDS = [
+    "herr", "talman", "och", "att", "det", "som", "för", "med", "på", "till", "är", "en", "ett", "av",
+    "ståndet", "riksdagen", "utskottet", "betänkande", "förslag", "frågan", "lag", "kejserliga", "senaten",
+    "eduskunta", "ja", "on", "että", "se", "valiokunta", "mietintö", "asia", "laki", "keisarillinen",
+    "protokoll", "justerades", "bordlades", "remitterades", "plenum", "sammanträde", "beslut",
+]
+DOCTYPES = ["prot", "ptk"]
+CHAMBERS = ["adeln", "borgare", "praster", "talonpojat"]
+NUMERALS = ["I", "II", "III", "IV", "V", "VI", "VII", "VIII", "IX", "X"]
+
+
+def synthetic_paragraph(rng, n_words=40):
+    """
+    Return a paragraph of random words
+
+    Args
+
+        rng (random.Random): seeded random generator
+        n_words (int): number of words
+
+    Returns
+
+        str
+    """
+    return " ".join(rng.choice(WORDS) for _ in range(n_words)).capitalize() + "."
+
+
+def synthetic_pages(rng, n_pages=10, paragraphs_per_page=8, n_words=40):
+    """
+    Return synthetic `convert_alto` output
+
+    Args
+
+        rng (random.Random): seeded random generator
+        n_pages (int): pages in the document
+        paragraphs_per_page (int): paragraphs on each page
+        n_words (int): words per paragraph
+
+    Returns
+
+        dict {page_nr: [paragraph, paragraph...]}
+    """
+    return {
+        f"{p:03d}": [synthetic_paragraph(rng, n_words) for _ in range(paragraphs_per_page)]
+        for p in range(1, n_pages + 1)
+    }
+
+
+def alto_page(paragraphs, nr):
+    """
+    Render a page of paragraphs as an ALTO v3 document readable with `alto.parse_file`
+
+    Args
+
+        paragraphs (list): paragraph strings, one text block each
+        nr (str): page number
+
+    Returns
+
+        str
+    """
+    pos = 'HEIGHT="10" WIDTH="10" HPOS="0" VPOS="0"'
+    blocks = []
+    for b, paragraph in enumerate(paragraphs):
+        strings = "".join(
+            f'<String ID="s{b}_{w}" {pos} CONTENT={quoteattr(word)} WC="0.9"/><SP WIDTH="1" HPOS="0" VPOS="0"/>'
+            for w, word in enumerate(paragraph.split())
+        )
+        blocks.append(f'<TextBlock ID="tb{b}" {pos}><TextLine ID="tl{b}" {pos}>{strings}</TextLine></TextBlock>')
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#">'
+        '<Description><MeasurementUnit>pixel</MeasurementUnit>'
+        f'<sourceImageInformation><fileName>{nr}.jpg</fileName></sourceImageInformation></Description>'
+        f'<Layout><Page ID="p{nr}" HEIGHT="10" WIDTH="10" PHYSICAL_IMG_NR="{int(nr)}">'
+        f'<PrintSpace {pos}><ComposedBlock ID="cb{nr}" {pos}>{"".join(blocks)}</ComposedBlock></PrintSpace>'
+        '</Page></Layout></alto>\n'
+    )
+
+
+def document_names(n_documents, seed=0):
+    """
+    Return unique document names following the corpus naming convention
+
+    Args
+
+        n_documents (int): number of names
+        seed (int): random seed
+
+    Returns
+
+        list of (yearstr, name) tuples
+    """
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < n_documents:
+        year = rng.randint(1863, 1906)
+        yearstr = f"{year}-{year + 1}" if rng.random() < 0.2 else str(year)
+        name = f"{rng.choice(DOCTYPES)}_{yearstr}_{rng.choice(CHAMBERS)}_{rng.choice(NUMERALS)}"
+        names.add((yearstr, name))
+    return sorted(names)
+
+
+def persons_tables(n_persons=1000, n_tables=3, seed=0):
+    """
+    Return persons metadata tables sharing the `swerik_person_id` key, as read by `metadata.fetch_metadata_tables`
+
+    Args
+
+        n_persons (int): persons per table
+        n_tables (int): number of tables
+        seed (int): random seed
+
+    Returns
+
+        list of pd.DataFrame objects
+    """
+    rng = random.Random(seed)
+    tables = []
+    for t in range(n_tables):
+        ids = rng.sample(range(n_persons * 2), n_persons)
+        tables.append(pd.DataFrame({
+            "swerik_person_id": [f"i-{_:08d}" for _ in ids],
+            f"value_{t}": [rng.choice(WORDS) for _ in ids],
+            f"year_{t}": [rng.randint(1863, 1906) for _ in ids],
+        }))
+    return tables
+
+
+def generate_corpus(root, n_documents=10, n_pages=10, paragraphs_per_page=8, n_words=40,
+                    formats=("alto", "tei"), seed=0):
+    """
+    Write a synthetic records corpus to disk.
+
+    ALTO pages are written to `<root>/valtiopaivat-records-alto/data/<year>/<doc>/<doc>-<nr>.xml`
+    and TEI documents to `<root>/valtiopaivat-records/data/<year>/<doc>.xml`.
+
+    Args
+
+        root (str): directory to write to
+        n_documents (int): number of documents
+        n_pages (int): pages per document
+        paragraphs_per_page (int): paragraphs per page
+        n_words (int): words per paragraph
+        formats (tuple): "alto" and/or "tei"
+        seed (int): random seed
+
+    Returns
+
+        config (ValtiopaivatCorpusConfig) pointing at the generated locations. It is not written to disk.
+    """
+    rng = random.Random(seed)
+    alto_location = os.path.abspath(f"{root}/valtiopaivat-records-alto")
+    tei_location = os.path.abspath(f"{root}/valtiopaivat-records")
+    for yearstr, name in document_names(n_documents, seed=seed):
+        pages = synthetic_pages(rng, n_pages, paragraphs_per_page, n_words)
+        if "alto" in formats:
+            doc_dir = f"{alto_location}/data/{yearstr}/{name}"
+            os.makedirs(doc_dir, exist_ok=True)
+            for nr, paragraphs in pages.items():
+                with open(f"{doc_dir}/{name}-{nr}.xml", 'w+') as outf:
+                    outf.write(alto_page(paragraphs, nr))
+        if "tei" in formats:
+            data = infer_metadata(name)
+            data["paragraphs"] = pages
+            # write-read-write like the real conversion, so the files are formatted
+            dict_to_parlaclarin(data, f"{tei_location}/data/{yearstr}")
+    return ValtiopaivatCorpusConfig(
+        ConfigName="synthetic",
+        ValtiopaivatRecordsALTOLocation=alto_location if "alto" in formats else None,
+        ValtiopaivatRecordsTEILocation=tei_location if "tei" in formats else None,
+    )
@@ -8,18 +8,27 @@ from pyriksdagen.utils import (
     parse_tei,
 
 )
+from valtiopy import instrument
 import json
+import numpy as np
+import os
+import pandas as pd
+import re
+import warnings
 
 
 
 
-def write_tei(elem, dest_path, padding=8) -> None:
+def tei_to_bytes(elem, padding=8) -> bytes:
     """
-    Write a corpus document to disk.
+    Format a corpus document and serialize it the way it is written to disk.
 
     Args:
         elem (etree._Element): tei root element
-        dest_path (str): protocol path
+        padding (int): indentation of paragraph text
+
+    Returns:
+        bytes
     """
     def _sort_attrs(elem):
         custom_order = ["xml:id", "type", "subtype"]
@@ -64,7 +73,7 @@ def write_tei(elem, dest_path, padding=8) -> None:
                         yield "p", elem
                     else:
                         warnings.warn(f"Unrecognized element {elem.tag}")
-                        yield None
+                        yield None, elem
 
     def _format_paragraph(paragraph, spaces):
         s = "\n" + " " * spaces
@@ -110,15 +119,49 @@ def write_tei(elem, dest_path, padding=8) -> None:
                     elem.getparent().remove(elem)
         return root
 
-    elem = _format_texts(elem, padding=padding)
-    b = etree.tostring(
-        elem,
-        pretty_print=True,
-        encoding="utf-8",
-        xml_declaration=True
-    )
-    with open(dest_path, "wb") as f:
-        f.write(b)
+    with instrument.timer("_format_texts"):
+        elem = _format_texts(elem, padding=padding)
+    with instrument.timer("etree.tostring"):
+        return etree.tostring(
+            elem,
+            pretty_print=True,
+            encoding="utf-8",
+            xml_declaration=True
+        )
+
+
+def write_tei(elem, dest_path, padding=8) -> None:
+    """
+    Write a corpus document to disk.
+
+    Args:
+        elem (etree._Element): tei root element
+        dest_path (str): protocol path
+    """
+    b = tei_to_bytes(elem, padding=padding)
+    with instrument.timer("write_tei"):
+        atomic_write(dest_path, b)
+    instrument.add_bytes("write_tei", written=len(b))
+
+
+def atomic_write(dest_path, b):
+    """
+    Write bytes to a temporary file next to the destination and rename it,
+    so the destination is never left half written.
+
+    Args:
+        dest_path (str): file path
+        b (bytes): content
+    """
+    tmp = f"{os.path.dirname(os.path.abspath(dest_path))}/.{os.path.basename(dest_path)}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(b)
+        os.replace(tmp, dest_path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
 
 
 def infer_metadata(filename, verbose=False):
@@ -152,5 +195,181 @@ def infer_metadata(filename, verbose=False):
     return metadata
 
 
+# the year part is a year, or two years separated by anything
+FILENAME_PATTERN = r"(?:^|/)(?P<filename>(?P<document_type>[^/_.]*)_(?P<yearstr>(?P<year>\d{4})(?:[^/_.]*(?P<secondary_year>\d{4}))?)_(?P<chamber>[^/_.]*)_(?P<number>[^/_.]*))(?:\.[^/]*)?$"
+# the same without the checks on the year, to tell bad years from bad names
+LOOSE_FILENAME_PATTERN = r"(?:^|/)[^/_.]*_[^/_.]*_[^/_.]*_[^/_.]*(?:\.[^/]*)?$"
+
+
+def infer_metadata_batch(paths):
+    """
+    Infer metadata from many filenames at once, with vectorized string operations.
+    Uses pyarrow compute functions when pyarrow is installed, which is a lot faster.
+
+    Args
+
+        paths (iterable or pd.Series): filenames or paths, relative or absolute
+
+    Returns
+
+        (metadata, malformed) tuple of DataFrames, with the same dtypes whichever way they were computed.
+        metadata has the columns of `infer_metadata` plus "path", with categorical "document_type" and "chamber",
+        integer "year", nullable integer "secondary_year" and "string" for the rest.
+        malformed has the columns "path" and "reason" ("missing", "year" or "filename") for the paths that can't be parsed.
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        return _infer_metadata_batch_pandas(paths)
+    return _infer_metadata_batch_arrow(paths)
+
+
+def _malformed(bad):
+    # few names are malformed, so only these are matched again
+    bad = bad.astype("string").reset_index(drop=True)
+    reason = np.where(bad.str.contains(LOOSE_FILENAME_PATTERN, na=False).to_numpy(dtype=bool), "year", "filename")
+    reason = np.where(bad.isna().to_numpy(dtype=bool), "missing", reason)
+    return pd.DataFrame({"path": bad, "reason": pd.array(reason, dtype="string")})
+
+
+def _infer_metadata_batch_pandas(paths):
+    paths = pd.Series(paths, dtype="string").reset_index(drop=True)
+    df = paths.str.extract(FILENAME_PATTERN)
+    ok = df["filename"].notna().to_numpy(dtype=bool)
+    df = df[ok]
+    chamber = df["chamber"].str.capitalize()
+    metadata = pd.DataFrame({
+        "path": paths[ok],
+        "filename": df["filename"],
+        "document_type": df["document_type"].astype("category"),
+        "chamber": chamber.where(chamber != "").astype("category"),
+        "yearstr": df["yearstr"],
+        "year": df["year"].astype("int16"),
+        "secondary_year": df["secondary_year"].astype("Int16"),
+        "number": df["number"],
+    }).reset_index(drop=True)
+    return metadata, _malformed(paths[~ok])
+
+
+def _infer_metadata_batch_arrow(paths):
+    # match without captures and split, extracting capture groups is several times slower
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    def _basename(components):
+        # last element of each list
+        return pc.take(pc.list_flatten(components), pc.subtract(components.offsets[1:], 1))
+
+    if isinstance(paths, pd.Series):
+        paths = paths.to_list()
+    # from_pandas: NaN is a missing path too
+    paths = pa.array(paths, pa.string(), from_pandas=True)
+    if isinstance(paths, pa.Array):
+        paths = pa.chunked_array([paths])
+    ok = pc.fill_null(pc.match_substring_regex(paths, FILENAME_PATTERN), False)
+    names = paths.filter(ok)
+    components = pc.split_pattern(names, "/")
+    basename = pa.chunked_array([_basename(c) for c in components.chunks], pa.string())
+    filename = pc.list_element(pc.split_pattern(basename, ".", max_splits=1), 0)
+    parts = pc.split_pattern(filename, "_")
+    document_type, yearstr, chamber, number = [pc.list_element(parts, i) for i in range(4)]
+    chamber = pc.utf8_capitalize(chamber)
+    secondary_year = pc.if_else(
+        pc.greater(pc.utf8_length(yearstr), 4),
+        pc.utf8_slice_codeunits(yearstr, -4),
+        pa.scalar(None, pa.string()),
+    )
+
+    def _series(arr):
+        # the dtypes of the pandas implementation
+        return pd.Series(arr.to_pandas(types_mapper={pa.string(): pd.StringDtype(), pa.int16(): pd.Int16Dtype()}.get))
+
+    metadata = pd.DataFrame({
+        "path": _series(names),
+        "filename": _series(filename),
+        "document_type": _series(document_type).astype("category"),
+        "chamber": _series(pc.if_else(pc.equal(chamber, ""), pa.scalar(None, pa.string()), chamber)).astype("category"),
+        "yearstr": _series(yearstr),
+        "year": pd.Series(pc.cast(pc.utf8_slice_codeunits(yearstr, 0, 4), pa.int16()).to_numpy()),
+        "secondary_year": _series(pc.cast(secondary_year, pa.int16())),
+        "number": _series(number),
+    })
+    return metadata, _malformed(_series(paths.filter(pc.invert(ok))))
+
+
+def pb_page(facs):
+    """
+    Return the page number of a facsimile URL, the inverse of `valtiopy.curate.pb_facs`
+
+    Args
+
+        facs (str): facs attribute of a pb element
+
+    Return
+
+        page number (str), None if it can't be found
+    """
+    if facs is None:
+        return None
+    m = FACS_PAGE.search(facs)
+    if m is None:
+        return None
+    return m.group(1)
+
+
+def iter_tei_paragraphs(path, tags=("note", "p", "u", "seg")):
+    """
+    Stream the text elements of a TEI file's body without building the whole tree.
+
+    Args
+
+        path (str): path to a TEI file
+        tags (tuple): local names of the elements to yield, add "pb" to get the page breaks too
+
+    Yields
+
+        dict with the keys "tag", "xml_id", "parent_id" (the `u` of a `seg`), "page" (from the preceding `pb`) and "text" (whitespace normalized, None if empty).
+        `pb` rows have no text, but an extra key "facs".
+    """
+    page = None
+    in_body = False
+    for event, elem in etree.iterparse(path, events=("start", "end")):
+        tag = etree.QName(elem).localname
+        if tag == "body":
+            in_body = event == "start"
+            continue
+        if event == "start" or not in_body:
+            continue
+        if tag == "pb":
+            page = pb_page(elem.attrib.get("facs"))
+            if "pb" in tags:
+                yield {
+                    "tag": tag,
+                    "xml_id": elem.attrib.get(f"{XML_NS}id"),
+                    "parent_id": None,
+                    "page": page,
+                    "text": None,
+                    "facs": elem.attrib.get("facs"),
+                }
+        elif tag in tags:
+            parent = elem.getparent()
+            text = " ".join((elem.text or "").split())
+            yield {
+                "tag": tag,
+                "xml_id": elem.attrib.get(f"{XML_NS}id"),
+                "parent_id": parent.attrib.get(f"{XML_NS}id") if tag == "seg" else None,
+                "page": page,
+                "text": text if text != "" else None,
+            }
+        parent = elem.getparent()
+        if parent is not None and etree.QName(parent).localname == "div":
+            elem.clear()
+            while elem.getprevious() is not None:
+                del parent[0]
+
+
+# Bump when the output of tei_to_bytes changes, so that valtiopy.reformat reformats everything
+FORMATTER_VERSION = "1"
+FACS_PAGE = re.compile(r"-([^-/]+)\.pdf$")
 XML_NS = "{http://www.w3.org/XML/1998/namespace}"
 TEI_NS = "{http://www.tei-c.org/ns/1.0}"
@@ -0,0 +1,219 @@
+"""
+Validate TEI files of the Valtiopaivat Corpus.
+
+Files are streamed with `iterparse` and checked for
+- namespace correctness of `pb`, `u`, `p`, `note` and `seg` elements
+- duplicate and malformed `xml:id`s
+- empty elements
+- `pb` facs URLs that don't match the metadata in the filename
+
+Optionally each file is also validated against a RelaxNG (.rng) or XML Schema (.xsd) file,
+compiled once per worker process. Files are validated in parallel and the results are written
+as a JSON lines report, one line per file.
+"""
+from lxml import etree
+from multiprocessing import Pool
+from valtiopy.curate import pb_facs
+from valtiopy.utils import (
+    infer_metadata,
+    pb_page,
+    TEI_NS,
+    XML_NS,
+)
+import json
+import re
+
+
+
+
+CHECKED_TAGS = ["pb", "u", "p", "note", "seg"]
+TEXT_TAGS = ["p", "note", "seg"]
+NCNAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_.\-]*$")
+
+_SCHEMA = None
+
+
+def load_schema(schema_path):
+    """
+    Compile a RelaxNG (.rng) or XML Schema (.xsd) file
+
+    Args
+
+        schema_path (str): path to the schema
+
+    Returns
+
+        etree.RelaxNG or etree.XMLSchema
+    """
+    tree = etree.parse(schema_path)
+    if schema_path.endswith(".xsd"):
+        return etree.XMLSchema(tree)
+    return etree.RelaxNG(tree)
+
+
+def _error(errors, kind, elem, message):
+    errors.append({
+        "type": kind,
+        "line": elem.sourceline if elem is not None else None,
+        "message": message,
+    })
+
+
+def validate_file(path, schema=None):
+    """
+    Validate a single TEI file.
+
+    Args
+
+        path (str): path to a TEI file
+        schema: compiled schema from `load_schema` (optional)
+
+    Returns
+
+        dict with the keys "path", "ok", "elements" and "errors"
+    """
+    errors = []
+    ids = set()
+    n_elements = 0
+    try:
+        metadata = infer_metadata(path)
+    except ValueError:
+        metadata = None
+        _error(errors, "filename", None, "Can't infer metadata from the filename")
+
+    try:
+        for event, elem in etree.iterparse(path, events=("end",), collect_ids=False):
+            n_elements += 1
+            xml_id = elem.attrib.get(f"{XML_NS}id")
+            if xml_id is not None:
+                if xml_id in ids:
+                    _error(errors, "duplicate_id", elem, f"Duplicate xml:id {xml_id}")
+                ids.add(xml_id)
+                if NCNAME.match(xml_id) is None:
+                    _error(errors, "malformed_id", elem, f"Malformed xml:id {xml_id}")
+
+            tag = etree.QName(elem)
+            if tag.localname not in CHECKED_TAGS:
+                continue
+            if f"{{{tag.namespace}}}" != TEI_NS:
+                _error(errors, "namespace", elem, f"Element {tag.localname} is not in the TEI namespace")
+
+            if tag.localname in TEXT_TAGS:
+                if elem.text is None or elem.text.strip() == "":
+                    _error(errors, "empty", elem, f"Empty {tag.localname}")
+            elif tag.localname == "u":
+                if "".join(elem.itertext()).strip() == "":
+                    _error(errors, "empty", elem, "Empty u")
+            elif tag.localname == "pb" and metadata is not None:
+                facs = elem.attrib.get("facs")
+                nr = pb_page(facs)
+                if nr is None:
+                    _error(errors, "facs", elem, f"Missing or malformed facs: {facs}")
+                else:
+                    try:
+                        expected = pb_facs(metadata, nr)
+                    except KeyError:
+                        expected = None
+                    if facs != expected:
+                        _error(errors, "facs", elem, f"facs {facs} doesn't match the filename, expected {expected}")
+
+            # Elements directly under a div are done with, free memory
+            parent = elem.getparent()
+            if parent is not None and etree.QName(parent).localname == "div":
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+    except etree.XMLSyntaxError as e:
+        _error(errors, "syntax", None, str(e))
+
+    if schema is not None and not any(e["type"] == "syntax" for e in errors):
+        if not schema.validate(etree.parse(path)):
+            for e in schema.error_log:
+                errors.append({"type": "schema", "line": e.line, "message": e.message})
+
+    return {
+        "path": path,
+        "ok": len(errors) == 0,
+        "elements": n_elements,
+        "errors": errors,
+    }
+
+
+def _init_worker(schema_path):
+    global _SCHEMA
+    if schema_path is not None:
+        _SCHEMA = load_schema(schema_path)
+
+
+def _validate_file(path):
+    return validate_file(path, schema=_SCHEMA)
+
+
+def validate_corpus(files, schema_path=None, processes=None, chunksize=8):
+    """
+    Validate TEI files in a process pool. Results are yielded as files are done, not in order.
+
+    Args
+
+        files (list): TEI file paths, e.g. args.tei_files
+        schema_path (str): path to a .rng or .xsd file (optional)
+        processes (int): number of worker processes (default: number of CPUs)
+        chunksize (int): files sent to a worker at a time
+
+    Yields
+
+        dict: see `validate_file`
+    """
+    with Pool(processes=processes, initializer=_init_worker, initargs=(schema_path,)) as pool:
+        for result in pool.imap_unordered(_validate_file, files, chunksize=chunksize):
+            yield result
+
+
+def write_report(results, report_path, verbose=False):
+    """
+    Write validation results to a JSON lines file, one file per line.
+
+    Args
+
+        results (iterable): output of `validate_corpus`
+        report_path (str): where to write the report
+        verbose (bool): print failing files
+
+    Returns
+
+        summary (dict): number of files, failed files and errors per type
+    """
+    summary = {"files": 0, "failed": 0, "errors": {}}
+    with open(report_path, 'w+') as outf:
+        for result in results:
+            summary["files"] += 1
+            if not result["ok"]:
+                summary["failed"] += 1
+                if verbose: print(f"INFO: {result['path']} has {len(result['errors'])} errors")
+            for e in result["errors"]:
+                summary["errors"][e["type"]] = summary["errors"].get(e["type"], 0) + 1
+            outf.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return summary
+
+
+
+
+if __name__ == '__main__':
+    from valtiopy.args import (
+        fetch_parser,
+        impute_arg_values,
+        reject_unsupported,
+    )
+    parser = fetch_parser(description=__doc__)
+    parser.add_argument("--schema",
+                        default = None,
+                        help = "Validate against a RelaxNG (.rng) or XML Schema (.xsd) file")
+    parser.add_argument("--report",
+                        default = "validation-report.jsonl",
+                        help = "Where to write the report")
+    args = parser.parse_args()
+    reject_unsupported(parser, args, "resume")
+    args = impute_arg_values(args)
+    summary = write_report(validate_corpus(args.tei_files, schema_path=args.schema, processes=args.jobs, chunksize=args.chunksize or 8),
+                           args.report, verbose=args.verbose)
+    print(json.dumps(summary, indent=2))